@@ -0,0 +1,255 @@
+import sys
+import re
+import time
+import json
+import multiprocessing
+from array import array
+
+import JMDictToJSON
+
+# Aho-Corasick automaton over every keb and reb of a dictionary, finding all the headwords in a text in one left to right
+#   pass. Its trie is a double-array: characters are numbered from 1 by alphabet, most frequent first, and the child of
+#   state s on character c is t = base[s] + c when check[t] == s, 0 being the root and -1 marking free slots. fail gives the
+#   state of the longest proper suffix of a state's string that is also in the trie, headwordIds the headword ending at a
+#   state (or -1), outputs the first state along the fail chain, the state itself included, where a headword ends (or 0),
+#   outputLinks the same for the proper suffixes, and depths the length of a state's string. All tables are arrays, so that
+#   the automaton is compact and quick to send to worker processes
+class Annotator:
+    def __init__(self, headwords):
+        self.headwords = [headword for headword in headwords if len(headword) > 0]
+        self.entries = [tuple(headwords[headword]) for headword in self.headwords]
+        self.compile()
+
+    @classmethod
+    def fromController(cls, controller):
+        if controller.headwords is None:
+            controller.buildHeadwordIndex()
+        return cls(controller.headwords)
+
+    def compile(self):
+        counts = {}
+        for headword in self.headwords:
+            for character in headword:
+                counts[character] = counts.get(character, 0) + 1
+        self.alphabet = {character: code for code, character in enumerate(sorted(counts, key=counts.get, reverse=True), 1)}
+        # Trie of dicts, one per node, from the character codes to the next node
+        children = [{}]
+        terminals = {}
+        for headwordId, headword in enumerate(self.headwords):
+            node = 0
+            for character in headword:
+                code = self.alphabet[character]
+                child = children[node].get(code)
+                if child is None:
+                    child = len(children)
+                    children[node][code] = child
+                    children.append({})
+                node = child
+            terminals[node] = headwordId
+        # Places the nodes breadth first, each at the first base where all its children fit in free slots. used is searched
+        #   with a pattern of the gaps between the children, a free byte at each child and any byte between them
+        used = bytearray(len(children) + len(self.alphabet) + 1)
+        used[0] = 1
+        slots = [0] * len(children)
+        bases = [0] * len(children)
+        order = [0]
+        firstFree = 1
+        for node in order:
+            codes = sorted(children[node])
+            if len(codes) == 0:
+                continue
+            firstFree = used.find(0, firstFree)
+            pattern = re.compile(b'\\x00' + b''.join([b'.{' + str(codes[i] - codes[i - 1] - 1).encode("ascii") + b'}\\x00'
+                for i in range(1, len(codes))]), re.DOTALL)
+            match = pattern.search(used, max(firstFree, codes[0]))
+            if match is None:
+                # The children fit in new slots added at the end
+                slot = max(len(used), codes[0])
+                used.extend(bytes(slot + codes[-1] - codes[0] + 1 - len(used)))
+            else:
+                slot = match.start()
+            base = slot - codes[0]
+            bases[node] = base
+            for code in codes:
+                used[base + code] = 1
+                slots[children[node][code]] = base + code
+                order.append(children[node][code])
+        size = len(used) + len(self.alphabet) + 1
+        self.base = array('I', [0]) * size
+        self.check = array('i', [-1]) * size
+        self.headwordIds = array('i', [-1]) * size
+        self.depths = array('H', [0]) * size
+        self.check[0] = 0
+        for node in order:
+            slot = slots[node]
+            self.base[slot] = bases[node]
+            for code, child in children[node].items():
+                self.check[slots[child]] = slot
+                self.depths[slots[child]] = self.depths[slot] + 1
+            if node in terminals:
+                self.headwordIds[slot] = terminals[node]
+        # The children of the root fail to the root. Breadth first order gives the fail link of a state before its children
+        self.fail = array('I', [0]) * size
+        self.outputLinks = array('I', [0]) * size
+        self.outputs = array('I', [0]) * size
+        for node in order:
+            slot = slots[node]
+            for code, child in children[node].items():
+                child = slots[child]
+                fail = 0
+                if slot != 0:
+                    fail = self.fail[slot]
+                    target = self.getTransition(fail, code)
+                    while target < 0 and fail != 0:
+                        fail = self.fail[fail]
+                        target = self.getTransition(fail, code)
+                    fail = max(target, 0)
+                self.fail[child] = fail
+                self.outputLinks[child] = self.outputs[fail]
+                self.outputs[child] = child if self.headwordIds[child] >= 0 else self.outputs[fail]
+        self.states = len(order)
+
+    # Next state from state on the character numbered code, or -1 without a transition
+    def getTransition(self, state, code) -> int:
+        target = self.base[state] + code
+        return target if self.check[target] == state and target != 0 else -1
+
+    # Every headword found in text, overlapping ones included, as (start, end, headword id) in order of end, longest
+    #   first for the same end
+    def scan(self, text) -> list:
+        alphabet = self.alphabet
+        base = self.base
+        check = self.check
+        fail = self.fail
+        outputs = self.outputs
+        outputLinks = self.outputLinks
+        headwordIds = self.headwordIds
+        depths = self.depths
+        matches = []
+        state = 0
+        for end, character in enumerate(text, 1):
+            code = alphabet.get(character)
+            # No headword has this character, so none can go on past it
+            if code is None:
+                state = 0
+                continue
+            while True:
+                target = base[state] + code
+                if check[target] == state:
+                    state = target
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            output = outputs[state]
+            while output != 0:
+                matches.append((end - depths[output], end, headwordIds[output]))
+                output = outputLinks[output]
+        return matches
+
+    # All matches, overlapping ones included, as (start, end, ent_seqs) sorted by start, longest first
+    def findAll(self, text) -> list:
+        entries = self.entries
+        matches = self.scan(text)
+        matches.sort(key=lambda match: (match[0], -match[1]))
+        return [(start, end, entries[headwordId]) for start, end, headwordId in matches]
+
+    # Longest matches from left to right: at each position the longest headword starting there is kept, and the text
+    #   after it is scanned next. Characters starting no headword are skipped
+    def findLongest(self, text) -> list:
+        entries = self.entries
+        longest = {}
+        for start, end, headwordId in self.scan(text):
+            if end > longest.get(start, (0, 0))[0]:
+                longest[start] = (end, headwordId)
+        matches = []
+        position = 0
+        for start in sorted(longest):
+            if start >= position:
+                end, headwordId = longest[start]
+                matches.append((start, end, entries[headwordId]))
+                position = end
+        return matches
+
+    def annotate(self, text, overlapping=False) -> list:
+        return self.findAll(text) if overlapping else self.findLongest(text)
+
+    # Annotates documents with a pool of worker processes, batchSize documents at a time. Returns the annotations in the
+    #   order of documents
+    def annotateMany(self, documents, workers=None, overlapping=False, batchSize=64) -> list:
+        tasks = [(documents[i:i + batchSize], overlapping) for i in range(0, len(documents), batchSize)]
+        with multiprocessing.Pool(workers, initWorker, (self,)) as pool:
+            return [annotations for batch in pool.imap(annotateBatch, tasks) for annotations in batch]
+
+# Annotator of a worker process started by Annotator.annotateMany
+workerAnnotator = None
+
+def initWorker(annotator):
+    global workerAnnotator
+    workerAnnotator = annotator
+
+def annotateBatch(task):
+    documents, overlapping = task
+    return [workerAnnotator.annotate(document, overlapping) for document in documents]
+
+if __name__ == '__main__':
+    try:
+        filename = JMDictToJSON.filename
+        snapshot = None
+        parser = 'regex'
+        inputFilename = None
+        output = None
+        workers = 0
+        overlapping = False
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            if name == 'overlapping':
+                overlapping = True
+                continue
+            value = option.group(3)
+            if name == 'file':
+                filename = value
+            elif name == 'snapshot':
+                snapshot = value
+            elif name == 'parser':
+                parser = value
+            elif name == 'input':
+                inputFilename = value
+            elif name == 'output':
+                output = value
+            elif name == 'workers':
+                workers = int(value)
+            else:
+                raise Exception(sys.argv[i])
+        if inputFilename is None:
+            raise Exception('--input')
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    controller = JMDictToJSON.Controller(parser, None, ['keb', 'reb'])
+    epoch = time.perf_counter()
+    controller.loadDict(filename, snapshot)
+    annotator = Annotator.fromController(controller)
+    print('{states} states for {headwords} headwords, built in {seconds:.2f}s'.format(states=annotator.states,
+        headwords=len(annotator.headwords), seconds=time.perf_counter() - epoch))
+    # One document per line
+    with open(inputFilename, "r", encoding="utf8") as read_file:
+        documents = [line.rstrip('\n') for line in read_file]
+    epoch = time.perf_counter()
+    if workers > 0:
+        annotations = annotator.annotateMany(documents, workers, overlapping)
+    else:
+        annotations = [annotator.annotate(document, overlapping) for document in documents]
+    seconds = time.perf_counter() - epoch
+    characters = sum(map(len, documents))
+    print('{documents} documents, {characters} characters in {seconds:.2f}s: {rate:.0f} characters/s, {matches} matches'.format(
+        documents=len(documents), characters=characters, seconds=seconds, rate=characters / seconds if seconds > 0 else 0,
+        matches=sum(map(len, annotations))))
+    if output is not None:
+        with open(output, "w", encoding="utf8") as write_file:
+            for annotation in annotations:
+                write_file.write(json.dumps([[start, end, list(ent_seqs)] for start, end, ent_seqs in annotation], ensure_ascii=False) + '\n')
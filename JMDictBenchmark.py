@@ -0,0 +1,259 @@
+import sys
+import os
+import re
+import time
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import shutil
+
+import JMDictToJSON
+import JMDictGenerator
+
+cDir = os.path.dirname(os.path.abspath(__file__))
+baselineFilename = os.path.join(cDir, 'benchmark_baseline.json')
+
+# Seed of the generated files benchmarked when no file is given
+benchmarkSeed = 1
+
+# Each benchmark runs in its own process, so that its peak memory is its own. It returns the time spent in the measured
+#   call, the number of entries (or queries) it went through and the number of bytes it read or wrote
+class Benchmarks:
+    def __init__(self, filename, parser, workDir):
+        self.filename = filename
+        self.parser = parser
+        self.workDir = workDir
+        self.random = random.Random(1)
+        with open(filename, "rb") as read_file:
+            self.entries = read_file.read().count(b'<entry>')
+
+    def getController(self, load=True):
+        controller = JMDictToJSON.Controller(self.parser)
+        if load:
+            controller.loadDict(self.filename)
+        return controller
+
+    def getSample(self, values, count) -> list:
+        return [self.random.choice(values) for i in range(count)]
+
+    def timeQueries(self, query, values) -> tuple:
+        epoch = time.perf_counter()
+        for value in values:
+            query(value)
+        return time.perf_counter() - epoch, len(values), 0
+
+    def loadDict(self) -> tuple:
+        controller = self.getController(False)
+        epoch = time.perf_counter()
+        controller.loadDict(self.filename)
+        return time.perf_counter() - epoch, len(controller.entries), os.path.getsize(self.filename)
+
+    def loadLazy(self) -> tuple:
+        controller = self.getController(False)
+        epoch = time.perf_counter()
+        controller.loadDict(self.filename, lazy=True)
+        return time.perf_counter() - epoch, len(controller.entries), os.path.getsize(self.filename)
+
+    def loadSnapshot(self) -> tuple:
+        snapshot = os.path.join(self.workDir, 'snapshot')
+        self.getController(False).loadDict(self.filename, snapshot)
+        controller = self.getController(False)
+        epoch = time.perf_counter()
+        controller.loadDict(self.filename, snapshot)
+        return time.perf_counter() - epoch, len(controller.entries), os.path.getsize(snapshot)
+
+    def saveData(self) -> tuple:
+        controller = self.getController()
+        output = os.path.join(self.workDir, 'output.json')
+        epoch = time.perf_counter()
+        controller.saveData(0, output)
+        return time.perf_counter() - epoch, len(controller.entries), os.path.getsize(output)
+
+    def saveInPlace(self) -> tuple:
+        controller = self.getController(False)
+        output = os.path.join(self.workDir, 'output.json')
+        epoch = time.perf_counter()
+        controller.saveInPlace(self.filename, 0, 0, output)
+        return time.perf_counter() - epoch, self.entries, os.path.getsize(self.filename)
+
+    def lookupHeadword(self) -> tuple:
+        controller = self.getController()
+        return self.timeQueries(controller.lookupHeadword, self.getSample(list(controller.headwords), 20000))
+
+    def searchReadings(self) -> tuple:
+        controller = self.getController()
+        prefixes = [reading[:2] for reading in self.getSample(controller.readings, 20000)]
+        return self.timeQueries(lambda prefix: controller.searchReadings(prefix, 10), prefixes)
+
+    def buildGlossIndex(self) -> tuple:
+        controller = self.getController()
+        epoch = time.perf_counter()
+        controller.buildGlossIndex()
+        return time.perf_counter() - epoch, len(controller.entries), 0
+
+    def searchGlosses(self) -> tuple:
+        controller = self.getController()
+        controller.buildGlossIndex()
+        glosses = [gloss for entry in controller.entries.values() for sense in entry.sense for gloss in sense.gloss]
+        return self.timeQueries(lambda gloss: controller.searchGlosses(gloss, 10), self.getSample(glosses, 5000))
+
+    def getRelated(self) -> tuple:
+        controller = self.getController()
+        controller.buildGraph()
+        return self.timeQueries(lambda ent_seq: controller.getRelated(ent_seq, 2), self.getSample(list(controller.entries), 20000))
+
+    def lookupIndex(self) -> tuple:
+        indexFilename = os.path.join(self.workDir, 'index')
+        controller = self.getController(False)
+        controller.buildIndex(self.filename, indexFilename)
+        index = JMDictToJSON.EntryIndex(self.filename, indexFilename, self.parser)
+        ent_seqs = self.getSample([str(index[i]) for i in range(len(index))], 20000)
+        result = self.timeQueries(index.lookup, ent_seqs)
+        index.close()
+        return result
+
+benchmarkNames = ('loadDict', 'loadLazy', 'loadSnapshot', 'saveData', 'saveInPlace', 'lookupHeadword', 'searchReadings', 'buildGlossIndex',
+    'searchGlosses', 'getRelated', 'lookupIndex')
+
+# Runs one benchmark in this process and prints its result as JSON
+def runBenchmark(name, filename, parser):
+    workDir = tempfile.mkdtemp()
+    try:
+        seconds, count, size = getattr(Benchmarks(filename, parser, workDir), name)()
+    finally:
+        shutil.rmtree(workDir)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    print(json.dumps({'seconds': seconds, 'count': count, 'bytes': size, 'peakMemory': peakMemory}))
+
+# Runs every benchmark `repeat` times in a fresh process and keeps the best time and lowest peak memory of each
+def runBenchmarks(names, filename, parser, repeat) -> dict:
+    results = {}
+    for name in names:
+        best = None
+        for i in range(repeat):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run=' + name, '--file=' + filename,
+                '--parser=' + parser], stdout=subprocess.PIPE, check=True, cwd=cDir).stdout
+            result = json.loads(output.decode("utf8").splitlines()[-1])
+            if best is None:
+                best = result
+            else:
+                best['seconds'] = min(best['seconds'], result['seconds'])
+                best['peakMemory'] = min(best['peakMemory'], result['peakMemory'])
+        results[name] = best
+        printResult(name, best)
+    return results
+
+def printResult(name, result):
+    seconds = result['seconds']
+    line = '{name:<16}{seconds:>10.3f} s{rate:>12.0f} /s'.format(name=name, seconds=seconds, rate=result['count'] / seconds)
+    if result['bytes'] > 0:
+        line += '{throughput:>10.1f} MB/s'.format(throughput=result['bytes'] / seconds / 1e6)
+    else:
+        line += '{us:>10.1f} us/op'.format(us=seconds / result['count'] * 1e6)
+    line += '{peak:>10.1f} MB peak'.format(peak=result['peakMemory'] / 1e6)
+    print(line)
+
+# Runs the benchmarks with each parser, and gives the time of each one against the first parser
+def compareParsers(names, filename, parsers, repeat):
+    results = {}
+    for parser in parsers:
+        print('--parser=' + parser)
+        results[parser] = runBenchmarks(names, filename, parser, repeat)
+    for name in names:
+        reference = results[parsers[0]][name]['seconds']
+        print('{name:<16}'.format(name=name) + ''.join(['{parser:>8} {ratio:.2f}x'.format(parser=parser,
+            ratio=results[parser][name]['seconds'] / reference) for parser in parsers]))
+
+# Returns the benchmarks slower, or using more memory, than the baseline by more than tolerance (0.3 for 30%)
+def compareBaseline(baseline, results, tolerance) -> list:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        expected = baseline['results'][name]
+        for metric in ('seconds', 'peakMemory'):
+            if result[metric] > expected[metric] * (1 + tolerance):
+                regressions.append('{name} {metric}: {value:.4g} against {expected:.4g} in the baseline'.format(name=name,
+                    metric=metric, value=result[metric], expected=expected[metric]))
+    return regressions
+
+if __name__ == '__main__':
+    try:
+        entries = 20000
+        parser = 'regex'
+        repeat = 3
+        tolerance = 0.3
+        filename = None
+        run = None
+        names = benchmarkNames
+        saveBaseline = False
+        comparedParsers = None
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            if name == 'save-baseline':
+                saveBaseline = True
+                continue
+            value = option.group(3)
+            if name == 'entries':
+                entries = int(value)
+            elif name == 'parser':
+                parser = value
+            elif name == 'repeat':
+                repeat = int(value)
+            elif name == 'tolerance':
+                tolerance = float(value)
+            elif name == 'file':
+                filename = value
+            elif name == 'only':
+                names = value.split(',')
+                for benchmark in names:
+                    if benchmark not in benchmarkNames:
+                        raise Exception(sys.argv[i])
+            elif name == 'run':
+                run = value
+            elif name == 'compare-parsers':
+                comparedParsers = value.split(',')
+            else:
+                raise Exception(sys.argv[i])
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    if run is not None:
+        runBenchmark(run, filename, parser)
+        sys.exit(0)
+    config = {'entries': entries, 'parser': parser, 'generator': JMDictGenerator.generatorVersion}
+    if filename is None:
+        # Generated files are kept between runs, under a name giving everything their content depends on
+        filename = os.path.join(tempfile.gettempdir(), 'JMdict_benchmark_v{version}_seed{seed}_{entries}'.format(
+            version=JMDictGenerator.generatorVersion, seed=benchmarkSeed, entries=entries))
+        if not os.path.exists(filename):
+            JMDictGenerator.generate(filename, entries, benchmarkSeed)
+    else:
+        config = {'file': os.path.basename(filename), 'parser': parser}
+    if comparedParsers is not None:
+        compareParsers(names, filename, comparedParsers, repeat)
+        sys.exit(0)
+    results = runBenchmarks(names, filename, parser, repeat)
+    if saveBaseline:
+        with open(baselineFilename, "w", encoding="utf8") as write_file:
+            json.dump({'config': config, 'results': results}, write_file, indent=2)
+        print('Baseline written to ' + baselineFilename)
+    elif os.path.exists(baselineFilename):
+        with open(baselineFilename, "r", encoding="utf8") as read_file:
+            baseline = json.load(read_file)
+        if baseline['config'] != config:
+            print('The baseline was made with {config}, not compared'.format(config=baseline['config']))
+        else:
+            regressions = compareBaseline(baseline, results, tolerance)
+            for regression in regressions:
+                print('REGRESSION ' + regression)
+            if len(regressions) > 0:
+                sys.exit(1)
+            print('No regression against the baseline')
@@ -0,0 +1,223 @@
+import sys
+import os
+import re
+import time
+import json
+import mmap
+import itertools
+from array import array
+from collections import Counter
+
+import JMDictToJSON
+
+# Bits of the priorityFlags column, one per ke_pri/re_pri code found in the kanji or readings of an entry
+priorityFlags = ('news1', 'news2', 'ichi1', 'ichi2', 'spec1', 'spec2', 'gai1', 'gai2')
+
+# Tags kept by ColumnStore, and the element holding them
+tagKinds = {'pos': 'sense', 'misc': 'sense', 'field': 'sense', 'dial': 'sense', 'ke_inf': 'k_ele', 're_inf': 'r_ele'}
+
+# Columns of a ColumnStore and their array typecodes. There is one value per entry in entSeqs, priorities (see
+#   Controller.getPriority), priorityFlags and frequencyBands (xx of the nfxx code, 0 without one), and one per sense in
+#   senseEntries, the row of its entry. The senses of entry row n are senseOffsets[n] to senseOffsets[n + 1], and the same
+#   goes for kanjiOffsets and readingOffsets. Each tag kind has the entity ids of its tags in <kind>Codes and the entry
+#   row of each tag in <kind>Entries; tags of senses also have the sense row in <kind>Senses
+columnTypes = {'entSeqs': 'I', 'priorities': 'H', 'priorityFlags': 'B', 'frequencyBands': 'B', 'senseOffsets': 'I',
+    'kanjiOffsets': 'I', 'readingOffsets': 'I', 'senseEntries': 'I'}
+for kind, element in tagKinds.items():
+    columnTypes[kind + 'Codes'] = 'H'
+    columnTypes[kind + 'Entries'] = 'I'
+    if element == 'sense':
+        columnTypes[kind + 'Senses'] = 'I'
+
+# Element types of the .npy files written by ColumnStore.save, so that numpy.load(path, mmap_mode='r') reads them too
+npyTypes = {'B': 'u1', 'H': 'u2', 'I': 'u4'}
+
+# Integer-coded columns of the entries, senses and tags of a dictionary, for aggregate queries. Columns are arrays when
+#   built, or typed memoryviews over memory-mapped .npy files when loaded, and queries only use C-level iteration over
+#   them (map, zip, itertools.compress and Counter) rather than a Python loop per value. codes gives the code of each
+#   entity id
+class ColumnStore:
+    def __init__(self, columns, codes):
+        self.columns = columns
+        self.codes = codes
+        self.maps = []
+
+    @classmethod
+    def fromController(cls, controller):
+        return cls.fromEntries(controller.entries.values(), controller)
+
+    # Builds the columns from any iterable of entries, such as Controller.iterEntries, without keeping the entries
+    @classmethod
+    def fromEntries(cls, entries, controller):
+        columns = {name: array(typecode) for name, typecode in columnTypes.items()}
+        for name in ('senseOffsets', 'kanjiOffsets', 'readingOffsets'):
+            columns[name].append(0)
+        flags = {code: 1 << bit for bit, code in enumerate(priorityFlags)}
+        for row, entry in enumerate(entries):
+            columns['entSeqs'].append(int(entry.ent_seq))
+            columns['priorities'].append(controller.getPriority(entry))
+            entryFlags = 0
+            band = 0
+            for pri in [k_ele.ke_pri for k_ele in entry.k_ele] + [r_ele.re_pri for r_ele in entry.r_ele]:
+                for code in pri:
+                    if code.startswith('nf'):
+                        band = int(code[2:])
+                    else:
+                        entryFlags |= flags.get(code, 0)
+            columns['priorityFlags'].append(entryFlags)
+            columns['frequencyBands'].append(band)
+            for k_ele in entry.k_ele:
+                columns['ke_infCodes'].extend(k_ele.ke_inf)
+                columns['ke_infEntries'].extend([row] * len(k_ele.ke_inf))
+            for r_ele in entry.r_ele:
+                columns['re_infCodes'].extend(r_ele.re_inf)
+                columns['re_infEntries'].extend([row] * len(r_ele.re_inf))
+            for sense in entry.sense:
+                senseRow = len(columns['senseEntries'])
+                columns['senseEntries'].append(row)
+                for kind in ('pos', 'misc', 'field', 'dial'):
+                    values = getattr(sense, kind)
+                    if len(values) > 0:
+                        columns[kind + 'Codes'].extend(values)
+                        columns[kind + 'Entries'].extend([row] * len(values))
+                        columns[kind + 'Senses'].extend([senseRow] * len(values))
+            columns['senseOffsets'].append(len(columns['senseEntries']))
+            columns['kanjiOffsets'].append(columns['kanjiOffsets'][-1] + len(entry.k_ele))
+            columns['readingOffsets'].append(columns['readingOffsets'][-1] + len(entry.r_ele))
+        return cls(columns, list(controller.entities.codes))
+
+    # Writes every column to directory as <name>.npy, and the codes of the entity ids to codes.json
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name, typecode in columnTypes.items():
+            column = array(typecode, self.columns[name])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            header = "{{'descr': '<{type}', 'fortran_order': False, 'shape': ({length},), }}".format(type=npyTypes[typecode],
+                length=len(column))
+            # The header is padded so that the data starts on a 64 byte boundary
+            header += ' ' * (63 - (len(header) + 10) % 64) + '\n'
+            with open(os.path.join(directory, name + '.npy'), "wb") as write_file:
+                write_file.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode("latin1"))
+                column.tofile(write_file)
+        with open(os.path.join(directory, 'codes.json'), "w", encoding="utf8") as write_file:
+            json.dump(self.codes, write_file, ensure_ascii=False)
+
+    # Maps the columns written by save. Nothing is read until a query uses a column
+    @classmethod
+    def load(cls, directory):
+        columns = {}
+        maps = []
+        for name, typecode in columnTypes.items():
+            with open(os.path.join(directory, name + '.npy'), "rb") as read_file:
+                size = os.fstat(read_file.fileno()).st_size
+                headerLength = int.from_bytes(read_file.read(10)[8:10], 'little')
+                if size == 10 + headerLength:
+                    columns[name] = array(typecode)
+                    continue
+                columnMap = mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ)
+            maps.append(columnMap)
+            header = columnMap[10:10 + headerLength].decode("latin1")
+            if "'<{type}'".format(type=npyTypes[typecode]) not in header or sys.byteorder != 'little':
+                raise Exception('{name}.npy'.format(name=name))
+            columns[name] = memoryview(columnMap)[10 + headerLength:].cast(typecode)
+        with open(os.path.join(directory, 'codes.json'), "r", encoding="utf8") as read_file:
+            store = cls(columns, json.load(read_file))
+        store.maps = maps
+        return store
+
+    def close(self):
+        self.columns = {}
+        for columnMap in self.maps:
+            columnMap.close()
+        self.maps = []
+
+    # Mask over entry rows, 1 where the value of the entry column is in values (or where values(value) is true when it is
+    #   a function)
+    def getEntryMask(self, column, values) -> bytes:
+        if callable(values):
+            return bytes(map(bool, map(values, self.columns[column])))
+        return bytes(map(frozenset(values).__contains__, self.columns[column]))
+
+    # Values of an entry column, repeated for each row of rows (the entry rows of tags or senses)
+    def getEntryValues(self, column, rows):
+        return map(self.columns[column].__getitem__, rows)
+
+    # Counts the tags of kind, such as 'pos', as {code: count}. With by, the name of an entry column, (value, code) pairs
+    #   are counted instead. where is an (entry column, values) pair keeping only the tags of entries whose value of the
+    #   column is in values, or passes values when it is a function
+    def countTags(self, kind, by=None, where=None) -> dict:
+        codes = self.columns[kind + 'Codes']
+        rows = self.columns[kind + 'Entries']
+        if by is not None:
+            codes = zip(self.getEntryValues(by, rows), codes)
+        if where is not None:
+            mask = self.getEntryMask(*where)
+            codes = itertools.compress(codes, map(mask.__getitem__, rows))
+        counts = Counter(codes)
+        if by is not None:
+            return {(value, self.codes[code]): count for (value, code), count in counts.items()}
+        return {self.codes[code]: count for code, count in counts.items()}
+
+    # Counts the entries by the values of an entry column, such as frequencyBands, with where as in countTags
+    def countEntries(self, by, where=None) -> dict:
+        values = self.columns[by]
+        if where is not None:
+            values = itertools.compress(values, self.getEntryMask(*where))
+        return dict(Counter(values))
+
+    # ent_seqs of the entries matching where, as in countTags, or having a tag of code in kind. They are strings, as
+    #   everywhere else, so that they can be looked up in Controller.entries
+    def selectEntries(self, where=None, kind=None, code=None) -> list:
+        mask = None
+        if where is not None:
+            mask = self.getEntryMask(*where)
+        if kind is not None:
+            id = self.codes.index(code)
+            tagged = bytearray(len(self.columns['entSeqs']))
+            for row in itertools.compress(self.columns[kind + 'Entries'], map(id.__eq__, self.columns[kind + 'Codes'])):
+                tagged[row] = 1
+            mask = tagged if mask is None else bytes(map(min, mask, tagged))
+        if mask is None:
+            return list(map(str, self.columns['entSeqs']))
+        return list(map(str, itertools.compress(self.columns['entSeqs'], mask)))
+
+if __name__ == '__main__':
+    try:
+        filename = JMDictToJSON.filename
+        parser = 'regex'
+        output = 'columns'
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            value = option.group(3)
+            if name == 'file':
+                filename = value
+            elif name == 'parser':
+                parser = value
+            elif name == 'output':
+                output = value
+            else:
+                raise Exception(sys.argv[i])
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    # Glosses and the other text fields are not stored, so they are not parsed
+    controller = JMDictToJSON.Controller(parser, None, ['k_ele', 'r_ele', 'pos', 'misc', 'field', 'dial'])
+    epoch = time.perf_counter()
+    ColumnStore.fromEntries(controller.iterEntries(filename), controller).save(output)
+    print('Columns written to {output} in {seconds:.2f}s'.format(output=output, seconds=time.perf_counter() - epoch))
+    store = ColumnStore.load(output)
+    queries = (
+        ('pos by frequency band', lambda: store.countTags('pos', 'frequencyBands')),
+        ('misc of news1 entries', lambda: store.countTags('misc', None, ('priorityFlags', lambda flags: flags & 1))),
+        ('entries by frequency band', lambda: store.countEntries('frequencyBands')),
+    )
+    for name, query in queries:
+        epoch = time.perf_counter()
+        result = query()
+        print('{name:<28}{ms:>8.1f} ms{groups:>8} groups'.format(name=name, ms=(time.perf_counter() - epoch) * 1e3, groups=len(result)))
+    store.close()
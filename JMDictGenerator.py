@@ -0,0 +1,229 @@
+import sys
+import re
+import random
+import bisect
+import itertools
+
+# Entity blocks of the DTD header, in the order and with the comments of JMdict. Only a sample of each block is kept
+entityBlocks = (
+    ('dial', '(dialect)', (('hob', 'Hokkaido-ben'), ('ksb', 'Kansai-ben'), ('ktb', 'Kantou-ben'), ('kyb', 'Kyoto-ben'),
+        ('kyu', 'Kyuushuu-ben'), ('osb', 'Osaka-ben'), ('rkb', 'Ryuukyuu-ben'), ('tsb', 'Tosa-ben'))),
+    ('field', '', (('Buddh', 'Buddhism'), ('comp', 'computing'), ('food', 'food, cooking'), ('law', 'law'),
+        ('math', 'mathematics'), ('med', 'medicine'), ('music', 'music'), ('sports', 'sports'))),
+    ('ke_inf', '(kanji info)', (('ateji', 'ateji (phonetic) reading'), ('iK', 'word containing irregular kanji usage'),
+        ('io', 'irregular okurigana usage'), ('oK', 'word containing out-dated kanji or kanji usage'), ('rK', 'rarely-used kanji form'))),
+    ('misc', '(miscellaneous)', (('abbr', 'abbreviation'), ('arch', 'archaism'), ('col', 'colloquialism'),
+        ('hon', 'honorific or respectful (sonkeigo) language'), ('hum', 'humble (kenjougo) language'), ('id', 'idiomatic expression'),
+        ('on-mim', 'onomatopoeic or mimetic word'), ('sl', 'slang'), ('uk', 'word usually written using kana alone'),
+        ('yoji', 'yojijukugo'))),
+    ('pos', '(part-of-speech)', (('adj-i', 'adjective (keiyoushi)'), ('adj-na', 'adjectival nouns or quasi-adjectives (keiyodoshi)'),
+        ('adj-no', "nouns which may take the genitive case particle 'no'"), ('adv', 'adverb (fukushi)'), ('exp', 'expressions (phrases, clauses, etc.)'),
+        ('int', 'interjection (kandoushi)'), ('n', 'noun (common) (futsuumeishi)'), ('n-suf', 'noun, used as a suffix'),
+        ('prt', 'particle'), ('suf', 'suffix'), ('v1', 'Ichidan verb'), ('v5k', "Godan verb with 'ku' ending"),
+        ('v5r', "Godan verb with 'ru' ending"), ('v5s', "Godan verb with 'su' ending"), ('vi', 'intransitive verb'),
+        ('vs', 'noun or participle which takes the aux. verb suru'), ('vt', 'transitive verb'))),
+    ('re_inf', '(reading info)', (('gikun', 'gikun (meaning as reading) or jukujikun (special kanji reading)'),
+        ('ik', 'word containing irregular kana usage'), ('ok', 'out-dated or obsolete kana usage'), ('uK', 'word usually written using kanji alone'))),
+)
+
+header = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE JMdict [
+<!ELEMENT JMdict (entry*)>
+<!--                   -->
+<!ELEMENT entry (ent_seq, k_ele*, r_ele*, sense+)>
+	<!-- Entries consist of kanji elements, reading elements,
+	general information and sense elements. Each entry must have at
+	least one reading element and one sense element. Others are optional.
+	-->
+<!ELEMENT ent_seq (#PCDATA)>
+<!ELEMENT k_ele (keb, ke_inf*, ke_pri*)>
+<!ELEMENT r_ele (reb, re_nokanji?, re_restr*, re_inf*, re_pri*)>
+<!ELEMENT sense (stagk*, stagr*, pos*, xref*, ant*, field*, misc*, s_inf*, lsource*, dial*, gloss*)>
+<!ATTLIST lsource xml:lang CDATA "eng">
+<!ATTLIST lsource ls_type CDATA #IMPLIED>
+<!ATTLIST lsource ls_wasei CDATA #IMPLIED>
+<!ATTLIST gloss xml:lang CDATA "eng">
+<!ATTLIST gloss g_type CDATA #IMPLIED>
+'''
+
+kana = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをんがぎぐげござじずぜぞだでどばびぶべぼぱぴぷぺぽ'
+katakana = 'アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワンガギグゲゴパピプペポー'
+kanji = '日本語学生先時間人大中小山川田水火木金土上下左右年月見行来出入言話読書食飲手足口目耳心気天雨電車道国外内前後東西南北高安新古長'
+syllables = ('ka', 'ri', 'to', 'me', 'sa', 'po', 'lin', 'der', 'ing', 'ste', 'an', 'or', 'ble', 'cu', 'ty', 'ma', 'ex', 'wa', 'pre', 'tion')
+priorityCodes = ('news1', 'news2', 'ichi1', 'ichi2', 'spec1', 'spec2', 'gai1', 'gai2')
+languages = ('eng', 'fre', 'ger', 'por', 'dut', 'ita', 'rus')
+
+# Version of the files written, raised whenever the same seed starts giving a different file, so that files generated by
+#   an earlier version, such as those cached by JMDictBenchmark.py, are not mistaken for current ones
+generatorVersion = 2
+
+# Writes a JMdict-shaped file of `entries` entries. The proportions of kanji elements, readings, senses and optional
+#   elements roughly follow the real file, and the same seed always gives the same file
+class Generator:
+    def __init__(self, seed=1):
+        self.random = random.Random(seed)
+        self.entities = {entityType: [name for name, description in values] for entityType, entityName, values in entityBlocks}
+        # English words, picked with a Zipf distribution so that gloss searches see common and rare words
+        words = ['to', 'the', 'a', 'of', 'one', 'person', 'thing', 'make', 'be', 'do', 'eat', 'drink', 'see', 'go', 'come', 'big', 'small']
+        while len(words) < 4000:
+            word = ''.join(self.random.sample(syllables, self.random.randint(1, 3)))
+            if word not in words:
+                words.append(word)
+        self.words = words
+        self.wordWeights = list(itertools.accumulate([1 / (rank + 1) for rank in range(len(words))]))
+        self.headwords = []
+
+    def choose(self, weights) -> int:
+        return bisect.bisect(list(itertools.accumulate(weights)), self.random.random() * sum(weights))
+
+    def getWord(self) -> str:
+        return self.random.choices(self.words, cum_weights=self.wordWeights)[0]
+
+    def getKana(self, length) -> str:
+        alphabet = katakana if self.random.random() < 0.1 else kana
+        return ''.join([self.random.choice(alphabet) for i in range(length)])
+
+    def getKanji(self, length) -> str:
+        return ''.join([self.random.choice(kanji) for i in range(length)])
+
+    def getEntity(self, entityType) -> str:
+        return '&{name};'.format(name=self.random.choice(self.entities[entityType]))
+
+    def getGloss(self) -> str:
+        words = [self.getWord() for i in range(self.choose((50, 30, 15, 5)) + 1)]
+        if self.random.random() < 0.3:
+            words.insert(0, 'to')
+        return ' '.join(words)
+
+    def getPriority(self) -> list:
+        codes = self.random.sample(priorityCodes, self.choose((40, 40, 20)) + 1)
+        if self.random.random() < 0.6:
+            codes.append('nf{rank:02d}'.format(rank=self.random.randint(1, 48)))
+        return codes
+
+    def writeHeader(self, out):
+        out.write(header)
+        for entityType, entityName, values in entityBlocks:
+            out.write('<!-- <{entityType}> {entityName}entities -->\n'.format(entityType=entityType, entityName=entityName + ' ' if entityName else ''))
+            for name, description in values:
+                out.write('<!ENTITY {name} "{description}">\n'.format(name=name, description=description))
+        out.write(']>\n<!-- JMdict created: 2021-06-01 -->\n<JMdict>\n')
+
+    def writeEntry(self, out, ent_seq):
+        chance = self.random.random
+        lines = ['<entry>', '<ent_seq>{ent_seq}</ent_seq>'.format(ent_seq=ent_seq)]
+        kebs = []
+        for i in range(self.choose((15, 70, 11, 4))):
+            keb = self.getKanji(self.choose((10, 55, 25, 10)) + 1)
+            kebs.append(keb)
+            lines.append('<k_ele>')
+            lines.append('<keb>{keb}</keb>'.format(keb=keb))
+            if chance() < 0.03:
+                lines.append('<ke_inf>{entity}</ke_inf>'.format(entity=self.getEntity('ke_inf')))
+            if chance() < 0.12:
+                lines.extend(['<ke_pri>{code}</ke_pri>'.format(code=code) for code in self.getPriority()])
+            lines.append('</k_ele>')
+        rebs = []
+        for i in range(self.choose((88, 9, 3)) + 1):
+            reb = self.getKana(self.choose((5, 25, 35, 20, 15)) + 1)
+            rebs.append(reb)
+            lines.append('<r_ele>')
+            lines.append('<reb>{reb}</reb>'.format(reb=reb))
+            if len(kebs) > 0 and chance() < 0.01:
+                lines.append('<re_nokanji/>')
+            if len(kebs) > 1 and chance() < 0.2:
+                lines.append('<re_restr>{keb}</re_restr>'.format(keb=kebs[0]))
+            if chance() < 0.02:
+                lines.append('<re_inf>{entity}</re_inf>'.format(entity=self.getEntity('re_inf')))
+            if chance() < 0.12:
+                lines.extend(['<re_pri>{code}</re_pri>'.format(code=code) for code in self.getPriority()])
+            lines.append('</r_ele>')
+        senses = self.choose((70, 18, 7, 3, 2)) + 1
+        for i in range(senses):
+            lines.append('<sense>')
+            if len(kebs) > 1 and chance() < 0.05:
+                lines.append('<stagk>{keb}</stagk>'.format(keb=kebs[-1]))
+            if len(rebs) > 1 and chance() < 0.05:
+                lines.append('<stagr>{reb}</stagr>'.format(reb=rebs[-1]))
+            if i == 0 or chance() < 0.3:
+                for pos in self.random.sample(self.entities['pos'], self.choose((10, 65, 20, 5))):
+                    lines.append('<pos>&{pos};</pos>'.format(pos=pos))
+            if len(self.headwords) > 0 and chance() < 0.08:
+                lines.append('<xref>{reference}</xref>'.format(reference=self.getReference()))
+            if len(self.headwords) > 0 and chance() < 0.003:
+                lines.append('<ant>{reference}</ant>'.format(reference=self.random.choice(self.headwords)[0]))
+            if chance() < 0.06:
+                lines.append('<field>{entity}</field>'.format(entity=self.getEntity('field')))
+            if chance() < 0.2:
+                lines.append('<misc>{entity}</misc>'.format(entity=self.getEntity('misc')))
+            if chance() < 0.03:
+                lines.append('<s_inf>{text}</s_inf>'.format(text=' '.join([self.getWord() for j in range(4)])))
+            if chance() < 0.04:
+                # As in JMdict, xml:lang is left out for English, its default in the DTD
+                language = self.random.choice(languages)
+                attributes = '' if language == 'eng' else ' xml:lang="{language}"'.format(language=language)
+                if chance() < 0.2:
+                    lines.append('<lsource{attributes} ls_wasei="y"/>'.format(attributes=attributes))
+                else:
+                    lines.append('<lsource{attributes}>{word}</lsource>'.format(attributes=attributes, word=self.getWord()))
+            if chance() < 0.003:
+                lines.append('<dial>{entity}</dial>'.format(entity=self.getEntity('dial')))
+            for j in range(self.choose((45, 30, 15, 7, 3)) + 1):
+                if chance() < 0.02:
+                    lines.append('<gloss g_type="expl">{gloss}</gloss>'.format(gloss=self.getGloss()))
+                else:
+                    lines.append('<gloss>{gloss}</gloss>'.format(gloss=self.getGloss()))
+            lines.append('</sense>')
+        lines.append('</entry>\n')
+        out.write('\n'.join(lines))
+        self.headwords.append((kebs[0] if len(kebs) > 0 else rebs[0], rebs[0], senses))
+
+    # keb・reb・sense, keb・reb, keb・sense or keb, as in JMdict. A few references are left unresolvable
+    def getReference(self) -> str:
+        headword, reading, senses = self.random.choice(self.headwords)
+        form = self.choose((40, 30, 10, 20))
+        if self.random.random() < 0.02:
+            headword = self.getKanji(4)
+        if form == 0:
+            return '{headword}・{reading}・{sense}'.format(headword=headword, reading=reading, sense=self.random.randint(1, senses))
+        elif form == 1:
+            return '{headword}・{reading}'.format(headword=headword, reading=reading)
+        elif form == 2:
+            return '{headword}・{sense}'.format(headword=headword, sense=self.random.randint(1, senses))
+        return headword
+
+    def write(self, out, entries):
+        self.writeHeader(out)
+        for i in range(entries):
+            self.writeEntry(out, 1000000 + i * 10)
+        out.write('</JMdict>\n')
+
+def generate(filename, entries, seed=1):
+    with open(filename, "w", encoding="utf8", newline='\n') as write_file:
+        Generator(seed).write(write_file, entries)
+
+if __name__ == '__main__':
+    try:
+        entries = 20000
+        output = 'JMdict_synthetic'
+        seed = 1
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            value = option.group(3)
+            if name == 'entries':
+                entries = int(value)
+            elif name == 'output':
+                output = value
+            elif name == 'seed':
+                seed = int(value)
+            else:
+                raise Exception(sys.argv[i])
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    generate(output, entries, seed)
+    print('{entries} entries written to {output}'.format(entries=entries, output=output))
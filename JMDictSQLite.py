@@ -0,0 +1,214 @@
+import sys
+import os
+import re
+import time
+import sqlite3
+
+import JMDictToJSON
+
+# Tables written by SQLiteExporter. Rows of the same entry, sense or element are ordered by position. Tags are the
+#   entities of the DTD, with the ids used by the controller; the kind of a sense tag is pos, misc, field or dial.
+#   Priorities belong to either a kanji or a reading, and sense_details holds the other repeated values of a sense
+#   (stagk, stagr, xref, ant, s_inf and lsource) by kind
+schema = (
+    'CREATE TABLE entries (id INTEGER PRIMARY KEY)',
+    'CREATE TABLE kanji (id INTEGER PRIMARY KEY, entry_id INTEGER NOT NULL, position INTEGER NOT NULL, keb TEXT NOT NULL)',
+    'CREATE TABLE readings (id INTEGER PRIMARY KEY, entry_id INTEGER NOT NULL, position INTEGER NOT NULL, reb TEXT NOT NULL, nokanji INTEGER NOT NULL)',
+    'CREATE TABLE reading_restrictions (reading_id INTEGER NOT NULL, keb TEXT NOT NULL)',
+    'CREATE TABLE senses (id INTEGER PRIMARY KEY, entry_id INTEGER NOT NULL, position INTEGER NOT NULL)',
+    'CREATE TABLE glosses (id INTEGER PRIMARY KEY, sense_id INTEGER NOT NULL, position INTEGER NOT NULL, gloss TEXT NOT NULL)',
+    'CREATE TABLE sense_details (sense_id INTEGER NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL)',
+    'CREATE TABLE tags (id INTEGER PRIMARY KEY, code TEXT NOT NULL, description TEXT)',
+    'CREATE TABLE kanji_tags (kanji_id INTEGER NOT NULL, tag_id INTEGER NOT NULL)',
+    'CREATE TABLE reading_tags (reading_id INTEGER NOT NULL, tag_id INTEGER NOT NULL)',
+    'CREATE TABLE sense_tags (sense_id INTEGER NOT NULL, kind TEXT NOT NULL, tag_id INTEGER NOT NULL)',
+    'CREATE TABLE priorities (kanji_id INTEGER, reading_id INTEGER, code TEXT NOT NULL)',
+)
+
+# Built once every row is inserted, which is much faster than keeping them up to date row by row
+indexes = (
+    'CREATE INDEX kanji_entry ON kanji (entry_id)',
+    'CREATE INDEX kanji_keb ON kanji (keb)',
+    'CREATE INDEX readings_entry ON readings (entry_id)',
+    'CREATE INDEX readings_reb ON readings (reb)',
+    'CREATE INDEX reading_restrictions_reading ON reading_restrictions (reading_id)',
+    'CREATE INDEX senses_entry ON senses (entry_id)',
+    'CREATE INDEX glosses_sense ON glosses (sense_id)',
+    'CREATE INDEX sense_details_sense ON sense_details (sense_id)',
+    'CREATE INDEX kanji_tags_kanji ON kanji_tags (kanji_id)',
+    'CREATE INDEX kanji_tags_tag ON kanji_tags (tag_id)',
+    'CREATE INDEX reading_tags_reading ON reading_tags (reading_id)',
+    'CREATE INDEX reading_tags_tag ON reading_tags (tag_id)',
+    'CREATE INDEX sense_tags_sense ON sense_tags (sense_id)',
+    'CREATE INDEX sense_tags_tag ON sense_tags (tag_id)',
+    'CREATE INDEX priorities_kanji ON priorities (kanji_id)',
+    'CREATE INDEX priorities_reading ON priorities (reading_id)',
+)
+
+# External content FTS5 tables, filled from their table after the load. The trigram tokenizer lets readings be searched
+#   by any part of at least 3 characters, as Japanese has no spaces between words
+searchTables = (
+    "CREATE VIRTUAL TABLE glosses_fts USING fts5(gloss, content='glosses', content_rowid='id')",
+    "CREATE VIRTUAL TABLE readings_fts USING fts5(reb, content='readings', content_rowid='id', tokenize='{tokenizer}')",
+)
+
+# Columns of each table, in insertion order
+tableColumns = {
+    'entries': 1,
+    'kanji': 4,
+    'readings': 5,
+    'reading_restrictions': 2,
+    'senses': 3,
+    'glosses': 4,
+    'sense_details': 3,
+    'tags': 3,
+    'kanji_tags': 2,
+    'reading_tags': 2,
+    'sense_tags': 3,
+    'priorities': 3,
+}
+
+# Writes the entries of a JMdict file to a new SQLite database. Rows are gathered for batchSize entries and inserted with
+#   one executemany per table, all in a single transaction, with indexes and search tables built at the end. The
+#   database is written next to its final path and moved there once complete, so journaling and syncing are turned off
+class SQLiteExporter:
+    def __init__(self, controller=None, batchSize=10000):
+        self.controller = JMDictToJSON.Controller() if controller is None else controller
+        self.batchSize = batchSize
+        self.inserts = {table: 'INSERT INTO {table} VALUES ({values})'.format(table=table, values=','.join('?' * columns))
+            for table, columns in tableColumns.items()}
+        self.rows = {table: 0 for table in tableColumns}
+        self.insertTime = 0
+
+    def flush(self, connection, batch):
+        instrumentation = self.controller.instrumentation
+        epoch = time.perf_counter()
+        for table, rows in batch.items():
+            if len(rows) > 0:
+                connection.executemany(self.inserts[table], rows)
+                self.rows[table] += len(rows)
+                rows.clear()
+        seconds = time.perf_counter() - epoch
+        self.insertTime += seconds
+        instrumentation.addTime('insert', seconds)
+
+    # Appends the rows of entry to batch. Kanji, readings, senses and glosses are numbered from the counters in ids
+    def addEntry(self, entry, batch, ids):
+        entryId = int(entry.ent_seq)
+        batch['entries'].append((entryId,))
+        for position, k_ele in enumerate(entry.k_ele):
+            ids['kanji'] += 1
+            kanjiId = ids['kanji']
+            batch['kanji'].append((kanjiId, entryId, position, k_ele.keb))
+            batch['kanji_tags'].extend([(kanjiId, tag) for tag in k_ele.ke_inf])
+            batch['priorities'].extend([(kanjiId, None, code) for code in k_ele.ke_pri])
+        for position, r_ele in enumerate(entry.r_ele):
+            ids['readings'] += 1
+            readingId = ids['readings']
+            batch['readings'].append((readingId, entryId, position, r_ele.reb, 1 if r_ele.re_nokanji else 0))
+            batch['reading_restrictions'].extend([(readingId, keb) for keb in r_ele.re_restr])
+            batch['reading_tags'].extend([(readingId, tag) for tag in r_ele.re_inf])
+            batch['priorities'].extend([(None, readingId, code) for code in r_ele.re_pri])
+        for position, sense in enumerate(entry.sense):
+            ids['senses'] += 1
+            senseId = ids['senses']
+            batch['senses'].append((senseId, entryId, position))
+            for kind in ('pos', 'field', 'misc', 'dial'):
+                batch['sense_tags'].extend([(senseId, kind, tag) for tag in getattr(sense, kind)])
+            for kind in ('stagk', 'stagr', 'xref', 'ant', 's_inf', 'lsource'):
+                batch['sense_details'].extend([(senseId, kind, value) for value in getattr(sense, kind)])
+            for glossPosition, gloss in enumerate(sense.gloss):
+                ids['glosses'] += 1
+                batch['glosses'].append((ids['glosses'], senseId, glossPosition, gloss))
+
+    # Exports the entries of source, a path or a file object as taken by Controller.iterEntries, to database. Returns the number of entries
+    def export(self, source, database) -> int:
+        controller = self.controller
+        instrumentation = controller.instrumentation
+        instrumentation.start(controller.getInputSize(source))
+        temporary = database + '.tmp'
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        connection = sqlite3.connect(temporary, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('PRAGMA cache_size = -65536')
+            for statement in schema:
+                connection.execute(statement)
+            epoch = time.perf_counter()
+            connection.execute('BEGIN')
+            batch = {table: [] for table in tableColumns}
+            ids = {'kanji': 0, 'readings': 0, 'senses': 0, 'glosses': 0}
+            count = 0
+            for entry in controller.iterEntries(source):
+                self.addEntry(entry, batch, ids)
+                count += 1
+                if count % self.batchSize == 0:
+                    self.flush(connection, batch)
+                    instrumentation.progress(count, controller.getPosition())
+            entities = controller.entities
+            batch['tags'].extend([(id, code, entities.descriptions.get(code)) for id, code in enumerate(entities.codes)])
+            self.flush(connection, batch)
+            instrumentation.progress(count, instrumentation.size)
+            # The time spent outside of executemany is the time spent parsing and gathering rows
+            now = time.perf_counter()
+            instrumentation.addTime('parse', now - epoch - self.insertTime)
+            epoch = now
+            for statement in indexes:
+                connection.execute(statement)
+            epoch = controller.timePhase('index', epoch)
+            tokenizer = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+            for statement in searchTables:
+                connection.execute(statement.format(tokenizer=tokenizer))
+            connection.execute("INSERT INTO glosses_fts(glosses_fts) VALUES('rebuild')")
+            connection.execute("INSERT INTO readings_fts(readings_fts) VALUES('rebuild')")
+            connection.execute('COMMIT')
+            controller.timePhase('search', epoch)
+        finally:
+            connection.close()
+        os.replace(temporary, database)
+        return count
+
+if __name__ == '__main__':
+    try:
+        filename = JMDictToJSON.filename
+        output = 'JMdict.sqlite'
+        parser = 'regex'
+        batchSize = 10000
+        languages = None
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            value = option.group(3)
+            if name == 'file':
+                filename = value
+            elif name == 'output':
+                output = value
+            elif name == 'parser':
+                parser = value
+            elif name == 'batch':
+                batchSize = int(value)
+            elif name == 'languages':
+                languages = value.split(',')
+            else:
+                raise Exception(sys.argv[i])
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    instrumentation = JMDictToJSON.StatusLine() if sys.stderr.isatty() else None
+    controller = JMDictToJSON.Controller(parser, instrumentation, None, languages)
+    exporter = SQLiteExporter(controller, batchSize)
+    epoch = time.perf_counter()
+    entries = exporter.export(filename, output)
+    seconds = time.perf_counter() - epoch
+    controller.instrumentation.finish()
+    phases = controller.instrumentation.getMetrics()['phases']
+    rows = sum(exporter.rows.values())
+    print('{entries} entries, {rows} rows in {seconds:.2f}s'.format(entries=entries, rows=rows, seconds=seconds))
+    print('parse {parse:.2f}s, insert {insert:.2f}s ({rate:.0f} rows/s), index {index:.2f}s, search tables {search:.2f}s'.format(
+        parse=phases.get('parse', 0), insert=phases.get('insert', 0), rate=rows / max(phases.get('insert', 0), 1e-9),
+        index=phases.get('index', 0), search=phases.get('search', 0)))
@@ -0,0 +1,205 @@
+import sys
+import re
+import time
+import random
+import asyncio
+from collections import OrderedDict
+
+import JMDictToJSON
+
+# Line protocol: each request is one line, a command followed by one or more keys separated by tabs, and each answer is
+#   one line holding a JSON array with one result per key:
+#
+#   entry <ent_seq>...      the entry, or null
+#   headword <keb|reb>...   the entries with that keb or reb
+#   gloss <words>...        the best senses whose glosses contain the words, as {"sense": index, "entry": entry}
+#   stats                   number of entries, and size, hits and misses of the cache
+#
+# Errors are answered with {"error": "message"}
+# Keeps the JSON of the most recently used entries, dropping the least recently used one beyond size
+class EntryCache:
+    def __init__(self, size=10000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entry) -> str:
+        text = self.entries.get(entry.ent_seq)
+        if text is None:
+            self.misses += 1
+            text = entry.toString(0, 0, '')
+            self.entries[entry.ent_seq] = text
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(entry.ent_seq)
+        return text
+
+# Answers lookups on the entries of a loaded controller. Requests on a connection are answered in order
+class LookupServer:
+    def __init__(self, controller, cacheSize=10000, glossLimit=10):
+        self.controller = controller
+        self.cache = EntryCache(cacheSize)
+        self.glossLimit = glossLimit
+
+    def lookup(self, command, keys) -> str:
+        controller = self.controller
+        results = []
+        if command == 'entry':
+            for key in keys:
+                entry = controller.entries.get(key)
+                results.append('null' if entry is None else self.cache.get(entry))
+        elif command == 'headword':
+            for key in keys:
+                results.append('[' + ','.join([self.cache.get(entry) for entry in controller.lookupHeadword(key)]) + ']')
+        elif command == 'gloss':
+            for key in keys:
+                senses = ['{{"sense":{sense},"entry":{entry}}}'.format(sense=sense, entry=self.cache.get(entry))
+                    for entry, sense in controller.searchGlosses(key, self.glossLimit)]
+                results.append('[' + ','.join(senses) + ']')
+        elif command == 'stats':
+            return '{{"entries":{entries},"cached":{cached},"hits":{hits},"misses":{misses}}}'.format(entries=len(controller.entries),
+                cached=len(self.cache.entries), hits=self.cache.hits, misses=self.cache.misses)
+        else:
+            raise Exception(command)
+        return '[' + ','.join(results) + ']'
+
+    def answer(self, line) -> str:
+        words = line.rstrip('\r\n').split(' ', 1)
+        keys = words[1].split('\t') if len(words) > 1 else []
+        try:
+            return self.lookup(words[0], keys)
+        except Exception as e:
+            return '{{"error":"{message}"}}'.format(message=str(e).replace('\\', '\\\\').replace('"', '\\"'))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if line == b'':
+                    break
+                writer.write((self.answer(line.decode("utf8")) + '\n').encode("utf8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+# Latency benchmark: `concurrency` connections send `requests` requests in total, one at a time each, picked from the
+#   entries of controller (ent_seqs, kebs and rebs, and gloss words)
+class BenchmarkClient:
+    def __init__(self, controller, host, port, seed=1):
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        entries = list(controller.entries.values())
+        self.keys = {
+            'entry': [entry.ent_seq for entry in entries],
+            'headword': list(controller.headwords),
+            'gloss': [gloss.split(' ')[-1] for entry in entries for sense in entry.sense for gloss in sense.gloss],
+        }
+
+    def getRequest(self) -> str:
+        command = self.random.choice(('entry', 'entry', 'headword', 'gloss'))
+        return '{command} {key}\n'.format(command=command, key=self.random.choice(self.keys[command]))
+
+    async def runConnection(self, requests, latencies):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        for request in requests:
+            epoch = time.perf_counter()
+            writer.write(request.encode("utf8"))
+            await writer.drain()
+            await reader.readline()
+            latencies.append(time.perf_counter() - epoch)
+        writer.close()
+
+    async def run(self, requests, concurrency) -> dict:
+        latencies = []
+        batches = [[self.getRequest() for i in range(requests // concurrency)] for connection in range(concurrency)]
+        epoch = time.perf_counter()
+        await asyncio.gather(*[self.runConnection(batch, latencies) for batch in batches])
+        seconds = time.perf_counter() - epoch
+        latencies.sort()
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6
+        return {'requests': len(latencies), 'seconds': seconds, 'requestsPerSecond': len(latencies) / seconds,
+            'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)}
+
+async def benchmark(server, controller, host, port, requests, concurrency):
+    started = None
+    if server is not None:
+        started = await server.start(host, port)
+        port = started.sockets[0].getsockname()[1]
+    result = await BenchmarkClient(controller, host, port).run(requests, concurrency)
+    if started is not None:
+        started.close()
+        await started.wait_closed()
+    print('{requests} requests in {seconds:.2f}s: {rate:.0f} requests/s, latency p50 {p50:.0f}us, p90 {p90:.0f}us, p99 {p99:.0f}us'.format(
+        requests=result['requests'], seconds=result['seconds'], rate=result['requestsPerSecond'], p50=result['p50'], p90=result['p90'],
+        p99=result['p99']))
+
+if __name__ == '__main__':
+    try:
+        filename = JMDictToJSON.filename
+        snapshot = None
+        parser = 'regex'
+        host = '127.0.0.1'
+        port = None
+        cacheSize = 10000
+        bench = False
+        requests = 20000
+        concurrency = 8
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            if name == 'bench':
+                bench = True
+                continue
+            value = option.group(3)
+            if name == 'file':
+                filename = value
+            elif name == 'snapshot':
+                snapshot = value
+            elif name == 'parser':
+                parser = value
+            elif name == 'host':
+                host = value
+            elif name == 'port':
+                port = int(value)
+            elif name == 'cache':
+                cacheSize = int(value)
+            elif name == 'requests':
+                requests = int(value)
+            elif name == 'concurrency':
+                concurrency = int(value)
+            else:
+                raise Exception(sys.argv[i])
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    controller = JMDictToJSON.Controller(parser)
+    controller.loadDict(filename, snapshot)
+    controller.buildGlossIndex()
+    if bench:
+        # Without --port, the benchmark runs against a server started in the same process
+        server = LookupServer(controller, cacheSize) if port is None else None
+        asyncio.run(benchmark(server, controller, host, 0 if port is None else port, requests, concurrency))
+    else:
+        server = LookupServer(controller, cacheSize)
+        print('{entries} entries, serving on {host}:{port}'.format(entries=len(controller.entries), host=host, port=port or 8765))
+        try:
+            asyncio.run(server.serve(host, port or 8765))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,430 @@
+import sys
+import os
+import re
+import time
+import json
+import mmap
+import struct
+import bisect
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory, resource_tracker
+
+import JMDictToJSON
+
+# Layout of the buffers written by SharedDictionary.build: a header giving the format version and the byte offset and
+#   length of every section, in the order of sharedSections. Sections start on 8 byte boundaries
+sharedMagic = b'JMDF'
+sharedVersion = 1
+sharedSections = ('entities', 'strings', 'stringOffsets', 'entries', 'kanji', 'kanjiValues', 'readings', 'readingValues',
+    'senses', 'senseValues', 'entSeqs', 'entSeqRows', 'headwords', 'headwordOffsets', 'headwordRows')
+sharedHeader = struct.Struct('<4sI' + 'QQ' * len(sharedSections))
+
+# Sections other than entities and strings are tables of unsigned 32 bit integers. strings holds every distinct string of
+#   the dictionary in UTF-8, string n being strings[stringOffsets[n]:stringOffsets[n + 1]]. The record tables have one
+#   fixed-width record per entry, kanji, reading or sense, in file order, and a last record marking their end:
+#
+#   entries   ent_seq, first kanji, first reading, first sense. The kanji of entry n are its first kanji up to the first
+#             kanji of entry n + 1, and the same goes for readings and senses
+#   kanji     keb, then the start of ke_inf and ke_pri in kanjiValues
+#   readings  reb, re_nokanji (see nokanjiValues), then the start of re_restr, re_inf and re_pri in readingValues
+#   senses    the start of each field of senseFields in senseValues
+#
+#   Repeated values of a record run from its start to the start of its next field, or of the first field of the next
+#   record for the last one. They are string numbers, or entity ids for tags declared as entities. entSeqs holds the
+#   ent_seqs in increasing order and entSeqRows the row of each in entries. headwords holds the string numbers of every
+#   keb and reb, sorted as strings, and the rows of the entries using headword n are headwordRows[headwordOffsets[n]:
+#   headwordOffsets[n + 1]]. entities is the JSON of the entity types, names and descriptions, and of the code of each id
+kanjiFields = ('keb', 'ke_inf', 'ke_pri')
+readingFields = ('reb', 're_nokanji', 're_restr', 're_inf', 're_pri')
+senseFields = ('stagk', 'stagr', 'pos', 'xref', 'ant', 'field', 'misc', 's_inf', 'lsource', 'dial', 'gloss')
+entityFields = frozenset(('ke_inf', 're_inf', 'pos', 'field', 'misc', 'dial'))
+
+# Values of re_nokanji, stored by position
+nokanjiValues = (None, False, True)
+
+# Before Python 3.13 every process using a block of shared memory registers it with its resource tracker, which unlinks
+#   it when the process exits, even in workers that only attached it. Blocks are then kept out of the trackers, and only
+#   unlinked by their creator
+untrackedMemory = sys.version_info < (3, 13) and os.name == 'posix'
+
+# Read-only dictionary held in one flat buffer, so that any number of processes can use the same copy of it, through
+#   shared memory or a memory-mapped file. Nothing is read when it is attached: entries are SharedEntry objects
+#   reading their fields from the buffer when they are accessed. Entity ids are those of entities, entityTable by
+#   default, as for parsed entries
+class SharedDictionary:
+    def __init__(self, buffer, entities=None):
+        self.buffer = memoryview(buffer)
+        self.memory = None
+        self.map = None
+        header = sharedHeader.unpack_from(self.buffer, 0)
+        if header[0] != sharedMagic or header[1] != sharedVersion:
+            raise Exception('Not a shared dictionary, or made by another version')
+        if sys.byteorder != 'little':
+            raise Exception(sys.byteorder)
+        sections = {}
+        for i, name in enumerate(sharedSections):
+            offset, length = header[2 + i * 2], header[3 + i * 2]
+            sections[name] = self.buffer[offset:offset + length]
+        self.strings = sections.pop('strings')
+        self.setEntities(json.loads(bytes(sections.pop('entities'))), entities)
+        for name, section in sections.items():
+            setattr(self, name, section.cast('I'))
+        self.count = len(self.entries) // 4 - 1
+
+    # Adds the entities of the dictionary to entities. When they are numbered differently there, the ids read from the
+    #   buffer are replaced by entityIds[id]
+    def setEntities(self, data, entities):
+        entities = JMDictToJSON.entityTable if entities is None else entities
+        for entityType, values in data['entities'].items():
+            entities.addEntityType(entityType, values['__name__'])
+            for entityName, entityValue in values.items():
+                if entityName != '__name__':
+                    entities.addEntity(entityType, entityName, entityValue)
+        ids = [entities.getId(code) for code in data['codes']]
+        self.entityIds = None if ids == list(range(len(ids))) else ids
+
+    # Serializes the entries of a loaded controller into the layout described above
+    @staticmethod
+    def build(controller) -> bytearray:
+        strings = {}
+        pool = bytearray()
+        stringOffsets = array('I', [0])
+
+        def getString(value):
+            id = strings.get(value)
+            if id is None:
+                id = len(strings)
+                strings[value] = id
+                pool.extend(value.encode("utf8"))
+                stringOffsets.append(len(pool))
+            return id
+
+        def addValues(values, name, items):
+            if name in entityFields:
+                values.extend(items)
+            else:
+                values.extend([getString(item) for item in items])
+
+        tables = {name: array('I') for name in sharedSections if name not in ('entities', 'strings', 'stringOffsets')}
+        headwords = {}
+        for row, entry in enumerate(controller.entries.values()):
+            tables['entries'].extend((int(entry.ent_seq), len(tables['kanji']) // 3, len(tables['readings']) // 5,
+                len(tables['senses']) // 11))
+            for k_ele in entry.k_ele:
+                headwords.setdefault(k_ele.keb, {})[row] = None
+                tables['kanji'].extend((getString(k_ele.keb), len(tables['kanjiValues'])))
+                addValues(tables['kanjiValues'], 'ke_inf', k_ele.ke_inf)
+                tables['kanji'].append(len(tables['kanjiValues']))
+                addValues(tables['kanjiValues'], 'ke_pri', k_ele.ke_pri)
+            for r_ele in entry.r_ele:
+                headwords.setdefault(r_ele.reb, {})[row] = None
+                tables['readings'].extend((getString(r_ele.reb), nokanjiValues.index(r_ele.re_nokanji)))
+                for name in readingFields[2:]:
+                    tables['readings'].append(len(tables['readingValues']))
+                    addValues(tables['readingValues'], name, getattr(r_ele, name))
+            for sense in entry.sense:
+                for name in senseFields:
+                    tables['senses'].append(len(tables['senseValues']))
+                    addValues(tables['senseValues'], name, getattr(sense, name))
+        tables['entries'].extend((0, len(tables['kanji']) // 3, len(tables['readings']) // 5, len(tables['senses']) // 11))
+        tables['kanji'].extend((0, len(tables['kanjiValues']), 0))
+        tables['readings'].extend((0, 0, len(tables['readingValues']), 0, 0))
+        tables['senses'].extend([len(tables['senseValues'])] * 11)
+        entSeqs = tables['entries'][0:-4:4]
+        order = sorted(range(len(entSeqs)), key=entSeqs.__getitem__)
+        tables['entSeqs'] = array('I', [entSeqs[row] for row in order])
+        tables['entSeqRows'] = array('I', order)
+        tables['headwordOffsets'].append(0)
+        for headword in sorted(headwords):
+            tables['headwords'].append(getString(headword))
+            tables['headwordRows'].extend(headwords[headword])
+            tables['headwordOffsets'].append(len(tables['headwordRows']))
+        entities = controller.entities
+        sections = dict(tables)
+        sections['entities'] = json.dumps({'entities': entities.entities, 'codes': entities.codes}, ensure_ascii=False).encode("utf8")
+        sections['strings'] = pool
+        sections['stringOffsets'] = stringOffsets
+        buffer = bytearray(sharedHeader.size)
+        layout = []
+        for name in sharedSections:
+            buffer.extend(bytes(-len(buffer) % 8))
+            data = sections[name]
+            if isinstance(data, array):
+                data = data.tobytes()
+            layout.extend((len(buffer), len(data)))
+            buffer.extend(data)
+        sharedHeader.pack_into(buffer, 0, sharedMagic, sharedVersion, *layout)
+        return buffer
+
+    # Copies the dictionary of controller to a new block of shared memory, named name or given a random name. The block
+    #   lives until unlink is called, by its creator once every worker is done with it
+    @classmethod
+    def create(cls, controller, name=None, entities=None):
+        buffer = cls.build(controller)
+        memory = shared_memory.SharedMemory(name, create=True, size=len(buffer))
+        if untrackedMemory:
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        memory.buf[:len(buffer)] = buffer
+        dictionary = cls(memory.buf[:len(buffer)], entities)
+        dictionary.memory = memory
+        return dictionary
+
+    # Uses the block of shared memory made by create in another process
+    @classmethod
+    def attach(cls, name, entities=None):
+        if untrackedMemory:
+            memory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        else:
+            memory = shared_memory.SharedMemory(name, track=False)
+        dictionary = cls(memory.buf, entities)
+        dictionary.memory = memory
+        return dictionary
+
+    # Writes the dictionary of controller to a file, for open
+    @classmethod
+    def save(cls, controller, filename):
+        temporary = filename + '.tmp'
+        with open(temporary, "wb") as write_file:
+            write_file.write(cls.build(controller))
+        os.replace(temporary, filename)
+
+    # Maps a file written by save. Processes mapping the same file share its pages
+    @classmethod
+    def open(cls, filename, entities=None):
+        with open(filename, "rb") as read_file:
+            fileMap = mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ)
+        dictionary = cls(fileMap, entities)
+        dictionary.map = fileMap
+        return dictionary
+
+    # Views of the buffer are released first, as shared memory and maps cannot be closed while they are exported
+    def close(self):
+        for name in sharedSections:
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self.buffer.release()
+        if self.memory is not None:
+            self.memory.close()
+        if self.map is not None:
+            self.map.close()
+
+    # A dropped dictionary is closed first, as its shared memory or map could not be closed with the views left
+    def __del__(self):
+        self.close()
+
+    def unlink(self):
+        # unlink takes the block out of the tracker, so it is put back first
+        if untrackedMemory:
+            resource_tracker.register(self.memory._name, 'shared_memory')
+        self.memory.unlink()
+
+    def __len__(self):
+        return self.count
+
+    # Entries in file order
+    def __iter__(self):
+        return map(self.getEntry, range(self.count))
+
+    def getEntry(self, row):
+        return SharedEntry(self, row)
+
+    # Entry of the given ent_seq, or None
+    def get(self, ent_seq):
+        ent_seq = int(ent_seq)
+        i = bisect.bisect_left(self.entSeqs, ent_seq)
+        if i < len(self.entSeqs) and self.entSeqs[i] == ent_seq:
+            return SharedEntry(self, self.entSeqRows[i])
+        return None
+
+    # Entries with the given keb or reb
+    def lookupHeadword(self, headword) -> list:
+        headwords = self.headwords
+        key = headword.encode("utf8")
+        i = bisect.bisect_left(headwords, key, key=self.getBytes)
+        if i == len(headwords) or self.getBytes(headwords[i]) != key:
+            return []
+        offsets = self.headwordOffsets
+        return [SharedEntry(self, row) for row in self.headwordRows[offsets[i]:offsets[i + 1]]]
+
+    def getBytes(self, id) -> bytes:
+        return bytes(self.strings[self.stringOffsets[id]:self.stringOffsets[id + 1]])
+
+    def getString(self, id) -> str:
+        return str(self.strings[self.stringOffsets[id]:self.stringOffsets[id + 1]], "utf8")
+
+    # Repeated values in field column of record row of a table with records of width fields, the first of which is
+    #   repeated
+    def getValues(self, table, values, width, first, row, column, entity) -> tuple:
+        index = row * width + column
+        start = table[index]
+        end = table[index + 1 + (first if column == width - 1 else 0)]
+        if entity:
+            if self.entityIds is None:
+                return tuple(values[start:end])
+            return tuple(map(self.entityIds.__getitem__, values[start:end]))
+        return tuple(map(self.getString, values[start:end]))
+
+# Entry of a SharedDictionary. Its fields are those of Entry, read from the buffer on each access, so it can be
+#   written and compared like any other entry. Pickling it gives an Entry
+class SharedEntry(JMDictToJSON.Entry):
+    __slots__ = ('dictionary', 'row')
+
+    def __init__(self, dictionary, row):
+        self.dictionary = dictionary
+        self.row = row
+
+    # Rows of column of the entries table from this entry to the next
+    def getRows(self, column):
+        entries = self.dictionary.entries
+        return range(entries[self.row * 4 + column], entries[self.row * 4 + 4 + column])
+
+    @property
+    def ent_seq(self):
+        return str(self.dictionary.entries[self.row * 4])
+
+    @property
+    def k_ele(self):
+        return tuple([SharedK_Ele(self.dictionary, row) for row in self.getRows(1)])
+
+    @property
+    def r_ele(self):
+        return tuple([SharedR_Ele(self.dictionary, row) for row in self.getRows(2)])
+
+    @property
+    def sense(self):
+        return tuple([SharedSense(self.dictionary, row) for row in self.getRows(3)])
+
+class SharedK_Ele(JMDictToJSON.K_Ele):
+    __slots__ = ('dictionary', 'row')
+
+    def __init__(self, dictionary, row):
+        self.dictionary = dictionary
+        self.row = row
+
+    @property
+    def keb(self):
+        return self.dictionary.getString(self.dictionary.kanji[self.row * 3])
+
+class SharedR_Ele(JMDictToJSON.R_Ele):
+    __slots__ = ('dictionary', 'row')
+
+    def __init__(self, dictionary, row):
+        self.dictionary = dictionary
+        self.row = row
+
+    @property
+    def reb(self):
+        return self.dictionary.getString(self.dictionary.readings[self.row * 5])
+
+    @property
+    def re_nokanji(self):
+        return nokanjiValues[self.dictionary.readings[self.row * 5 + 1]]
+
+class SharedSense(JMDictToJSON.Sense):
+    __slots__ = ('dictionary', 'row')
+
+    def __init__(self, dictionary, row):
+        self.dictionary = dictionary
+        self.row = row
+
+# Property reading the repeated field name of the accessor class, from the given table, values and record layout
+def getValuesProperty(name, table, values, fields, first):
+    column = fields.index(name)
+    width = len(fields)
+    entity = name in entityFields
+    return property(lambda self: self.dictionary.getValues(getattr(self.dictionary, table), getattr(self.dictionary, values),
+        width, first, self.row, column, entity))
+
+for name in kanjiFields[1:]:
+    setattr(SharedK_Ele, name, getValuesProperty(name, 'kanji', 'kanjiValues', kanjiFields, 1))
+for name in readingFields[2:]:
+    setattr(SharedR_Ele, name, getValuesProperty(name, 'readings', 'readingValues', readingFields, 2))
+for name in senseFields:
+    setattr(SharedSense, name, getValuesProperty(name, 'senses', 'senseValues', senseFields, 0))
+
+# Dictionary of a worker process started by the benchmark below, and the time it took to attach it
+workerDictionary = None
+workerAttachTime = 0
+
+def attachWorker(name):
+    global workerDictionary, workerAttachTime
+    epoch = time.perf_counter()
+    workerDictionary = SharedDictionary.attach(name)
+    workerAttachTime = time.perf_counter() - epoch
+
+# Looks up every ent_seq of keys, writing each entry. Returns the attach time, the time taken and the private memory
+#   of the process
+def lookupWorker(keys):
+    epoch = time.perf_counter()
+    for key in keys:
+        workerDictionary.get(key).toString(0, 0, '')
+    return workerAttachTime, time.perf_counter() - epoch, getPrivateMemory()
+
+# Memory of this process not shared with others, in bytes, or 0 where /proc is not available
+def getPrivateMemory() -> int:
+    try:
+        with open('/proc/self/smaps_rollup', "r") as read_file:
+            return sum([int(line.split()[1]) * 1024 for line in read_file if line.startswith(('Private_Clean', 'Private_Dirty'))])
+    except OSError:
+        return 0
+
+if __name__ == '__main__':
+    try:
+        filename = JMDictToJSON.filename
+        snapshot = None
+        parser = 'regex'
+        output = None
+        workers = 4
+        lookups = 10000
+        for i in range(1, len(sys.argv)):
+            option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
+            if option == None:
+                raise Exception(sys.argv[i])
+            name = option.group(1)
+            value = option.group(3)
+            if name == 'file':
+                filename = value
+            elif name == 'snapshot':
+                snapshot = value
+            elif name == 'parser':
+                parser = value
+            elif name == 'output':
+                output = value
+            elif name == 'workers':
+                workers = int(value)
+            elif name == 'lookups':
+                lookups = int(value)
+            else:
+                raise Exception(sys.argv[i])
+    except Exception as e:
+        print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    controller = JMDictToJSON.Controller(parser)
+    controller.loadDict(filename, snapshot)
+    if output is not None:
+        epoch = time.perf_counter()
+        SharedDictionary.save(controller, output)
+        print('{entries} entries written to {output} in {seconds:.2f}s'.format(entries=len(controller.entries), output=output,
+            seconds=time.perf_counter() - epoch))
+        sys.exit(0)
+    epoch = time.perf_counter()
+    dictionary = SharedDictionary.create(controller)
+    print('{entries} entries, {size:.1f} MB of shared memory, built in {seconds:.2f}s'.format(entries=len(dictionary),
+        size=len(dictionary.buffer) / 1e6, seconds=time.perf_counter() - epoch))
+    tasks = [list(controller.entries)[i::workers][:lookups] for i in range(workers)]
+    # Workers are started afresh, so that they do not inherit the parsed dictionary
+    controller = None
+    try:
+        with multiprocessing.get_context('spawn').Pool(workers, attachWorker, (dictionary.memory.name,)) as pool:
+            results = pool.map(lookupWorker, tasks, 1)
+        print('attach {ms:.2f} ms per worker'.format(ms=sum([result[0] for result in results]) / len(results) * 1e3))
+        print('{lookups} lookups in {workers} workers in {seconds:.2f}s, {memory:.1f} MB of private memory per worker'.format(
+            lookups=sum(map(len, tasks)), workers=workers, seconds=max([result[1] for result in results]),
+            memory=sum([result[2] for result in results]) / len(results) / 1e6))
+    finally:
+        dictionary.close()
+        dictionary.unlink()
@@ -1,24 +1,144 @@
 import sys
-import pdb
 import os
 import re
 import time
-import math
+import json
+import io
+import gc
+import multiprocessing
+import hashlib
+import pickle
+import struct
+import mmap
+import bisect
+import itertools
+import gzip
+import bz2
+import lzma
+import xml.parsers.expat
+import xml.sax.saxutils
+from array import array
+from collections import defaultdict
 
 cDir = os.path.dirname(os.path.abspath(__file__))
 filename = os.path.join(cDir, 'JMdict_e')
 
-# Class used to handle spacing and newlines when printing text
+# Snapshots written by Controller.saveSnapshot start with this magic number and format version. The version must be
+#   increased whenever the model classes or the snapshot layout change, so that older snapshots are ignored
+snapshotMagic = b'JMDS'
+snapshotVersion = 2
+
+# Layout of the files written by Controller.buildIndex: a header giving the format version, the size of the indexed
+#   file and the number of records, followed by one fixed-width (ent_seq, offset, length) record per entry
+indexMagic = b'JMDI'
+indexVersion = 1
+indexHeader = struct.Struct('<4sIQI')
+indexRecord = struct.Struct('<IQI')
+
+# Whole entry of a JMdict file, with its ent_seq, matched on the raw bytes by buildIndex and lazy loading
+entryPattern = re.compile(rb'<entry>\s*<ent_seq>(\d+)</ent_seq>.*?</entry>\r?\n?', re.DOTALL)
+
+# Line starting an entry, possibly indented, where Controller.findChunkOffsets splits the file
+entryLinePattern = re.compile(rb'\n\s*<entry>')
+
+# Layout of the hash manifests written by Controller.saveChanges: a header giving the format version and the number of
+#   records, followed by one (ent_seq, hash) record per entry, sorted by ent_seq
+manifestMagic = b'JMDM'
+manifestVersion = 1
+manifestHeader = struct.Struct('<4sII')
+manifestRecord = struct.Struct('<I16s')
+
+# Kinds of the edges of the reference graph built by Controller.buildGraph
+graphKindNames = ('xref', 'ant')
+
+# Fields that can be selected when parsing, by element. ent_seq is always kept, and so are keb and reb whenever another
+#   field of their element is selected. Naming an element selects all of its fields
+elementFields = {
+    'k_ele': ('keb', 'ke_inf', 'ke_pri'),
+    'r_ele': ('reb', 're_nokanji', 're_restr', 're_inf', 're_pri'),
+    'sense': ('stagk', 'stagr', 'pos', 'xref', 'ant', 'field', 'misc', 's_inf', 'lsource', 'dial', 'gloss'),
+}
+
+# Text written for tags declared as entities, see Entities
+entityOutputs = ('codes', 'descriptions', 'ids')
+
+# How the lexer parser reads each tag, see Controller.lexEntry: 'text' keeps the text, 'code' interns it, 'entity' keeps
+#   the id of the entity, 'lsource' the language given by xml:lang, and 'gloss' the text of glosses in the selected
+#   languages. 'element' marks the k_ele, r_ele and sense elements, whose children follow
+lexKinds = {
+    'ent_seq': 'text',
+    'k_ele': 'element',
+    'keb': 'text',
+    'ke_inf': 'entity',
+    'ke_pri': 'code',
+    'r_ele': 'element',
+    'reb': 'text',
+    're_nokanji': 'text',
+    're_restr': 'text',
+    're_inf': 'entity',
+    're_pri': 'code',
+    'sense': 'element',
+    'stagk': 'text',
+    'stagr': 'text',
+    'pos': 'entity',
+    'xref': 'text',
+    'ant': 'text',
+    'field': 'entity',
+    'misc': 'entity',
+    's_inf': 'text',
+    'lsource': 'lsource',
+    'dial': 'entity',
+    'gloss': 'text',
+}
+
+# Output formats: a single JSON array, or JSON Lines with one entry per line
+outputFormats = {'json': '.json', 'jsonl': '.jsonl'}
+
+# Compressions applied to the output as it is written, with the extension added to the default output name
+outputCompressions = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+# Magic bytes of the compressed inputs recognized by Controller.openInput, with the module decompressing each
+inputCompressions = ((b'\x1f\x8b', gzip), (b'BZh', bz2), (b'\xfd7zXZ\x00', lzma))
+
+# Size of the reads from the input file, which also feed the decompressor of a compressed input
+inputBufferSize = 1 << 20
+
+# Entries written between two checkpoints of Controller.saveInPlace
+checkpointInterval = 10000
+
+# Weights of the ke_pri/re_pri codes used to rank entries, see Controller.getPriority. nfxx codes are scored separately
+priorityScores = {'news1': 20, 'ichi1': 20, 'spec1': 20, 'gai1': 20, 'news2': 10, 'ichi2': 10, 'spec2': 10, 'gai2': 10}
+
+# Words ignored in gloss searches, unless the query has nothing else
+glossStopwords = frozenset(['a', 'an', 'the', 'to', 'of', 'be', 'or', 'and', 'in', 'on', 'one', 's'])
+
+# Class used to handle spacing and newlines when printing text.
+# Subclasses implement write(out, indent, initialIndent, ...), which writes their JSON straight to the text stream out;
+#   toString returns the same text as a string
 class Text:
-    def getWhitespace(self, indent, initialIndent) -> str:
+    __slots__ = ()
+
+    def toString(self, *args) -> str:
+        buffer = io.StringIO()
+        self.write(buffer, *args)
+        return buffer.getvalue()
+
+    @staticmethod
+    def getWhitespace(indent, initialIndent) -> str:
         return ' '*(indent + initialIndent)
 
-    def getNewline(self, indent) -> str:
+    @staticmethod
+    def getNewline(indent) -> str:
         return '' if indent == 0 else '\n'
 
-    def getSpace(self, indent) -> str:
+    @staticmethod
+    def getSpace(indent) -> str:
         return '' if indent == 0 else ' '
 
+# The model classes below use __slots__ and keep element values as plain strings, and repeated elements as tuples of
+#   strings, since the full dictionary holds millions of them. Entity codes are interned by the parsers.
+#   The PCData classes further down only describe how each element is written
+
 # Class for entries of the JMDict. Each has the following form:
 #
 # ent_seq: int
@@ -26,83 +146,114 @@ class Text:
 # r_ele: r_ele*
 # sense: sense+
 class Entry(Text):
+    __slots__ = ('ent_seq', 'k_ele', 'r_ele', 'sense')
+
     def __init__(self, ent_seq, k_ele, r_ele, sense):
         self.ent_seq = ent_seq
-        self.k_ele = k_ele
-        self.r_ele = r_ele
-        self.sense = sense
+        self.k_ele = tuple(k_ele)
+        self.r_ele = tuple(r_ele)
+        self.sense = tuple(sense)
 
-    def getEnt_seqString(self, indent=0, initalIndent=0):
-        return self.ent_seq.toString(indent, initalIndent)
+    # Pickled as a constructor call, which is faster to load than the default slot by slot state
+    def __reduce__(self):
+        return (Entry, (self.ent_seq, self.k_ele, self.r_ele, self.sense))
 
-    def getFieldString(self, name, ele, indent=0, initialIndent=0):
-        if len(ele) == 0: return ''
+    def writeField(self, out, name, ele, indent=0, initialIndent=0, output='codes'):
+        if len(ele) == 0: return
         whitespace1 = self.getWhitespace(indent, initialIndent)
         whitespace2 = self.getWhitespace(indent, initialIndent + indent)
         newline = self.getNewline(indent)
         space = self.getSpace(indent)
-        msg = ',{newline}{whitespace1}"{name}":{space}['.format(name=name, newline=newline, whitespace1=whitespace1, space=space)
+        out.write(',{newline}{whitespace1}"{name}":{space}['.format(name=name, newline=newline, whitespace1=whitespace1, space=space))
         for i in range(len(ele)):
-            e = ele[i]
-            comma = ',' if i > 0 else ''
-            value = e.toString(indent, initialIndent + indent*2)
-            msg += '{comma}{newline}{whitespace2}{value}'.format(comma=comma, newline=newline, whitespace2=whitespace2, value=value)
-        msg += '{newline}{whitespace1}]'.format(newline=newline, whitespace1=whitespace1)
-        return msg
+            out.write('{comma}{newline}{whitespace2}'.format(comma=',' if i > 0 else '', newline=newline, whitespace2=whitespace2))
+            ele[i].write(out, indent, initialIndent + indent*2, output)
+        out.write('{newline}{whitespace1}]'.format(newline=newline, whitespace1=whitespace1))
 
-    def toString(self, indent=0, initialIndent=0, comma=',') -> str:
-        msg = ""
-        ent_seq = self.getEnt_seqString(indent, initialIndent)
-        k_ele = self.getFieldString('k_ele', self.k_ele, indent, initialIndent)
-        r_ele = self.getFieldString('r_ele', self.r_ele, indent, initialIndent)
-        sense = self.getFieldString('sense', self.sense, indent, initialIndent)
+    # output is how entities are written, one of entityOutputs
+    def write(self, out, indent=0, initialIndent=0, comma=',', output='codes'):
+        out.write('{')
+        Ent_seq.write(out, self.ent_seq, indent, initialIndent)
+        self.writeField(out, 'k_ele', self.k_ele, indent, initialIndent, output)
+        self.writeField(out, 'r_ele', self.r_ele, indent, initialIndent, output)
+        self.writeField(out, 'sense', self.sense, indent, initialIndent, output)
         newline = self.getNewline(indent)
         whitespace = self.getWhitespace(indent, initialIndent-indent)
-        msg = '{{{ent_seq}{k_ele}{r_ele}{sense}{newline}{whitespace}}}{comma}'.format(ent_seq=ent_seq, k_ele=k_ele, r_ele=r_ele, sense=sense, newline=newline, whitespace=whitespace, comma=comma)
-        return msg
+        out.write('{newline}{whitespace}}}{comma}'.format(newline=newline, whitespace=whitespace, comma=comma))
+
+# Entry of a dictionary loaded with loadDict(lazy=True). Only the ent_seq and the byte range of the entry in the file are
+#   kept; k_ele, r_ele and sense are parsed by the LazySource on first access
+class LazyEntry(Text):
+    __slots__ = ('ent_seq', 'lazySource', 'offset', 'length', 'entry')
+
+    def __init__(self, ent_seq, lazySource, offset, length):
+        self.ent_seq = ent_seq
+        self.lazySource = lazySource
+        self.offset = offset
+        self.length = length
+        self.entry = None
+
+    # The parsed Entry, kept on this object when the source caches decoded entries
+    def decode(self) -> Entry:
+        entry = self.entry
+        if entry is None:
+            entry = self.lazySource.decode(self.offset, self.length)
+            if self.lazySource.cache:
+                self.entry = entry
+        return entry
+
+    @property
+    def k_ele(self):
+        return self.decode().k_ele
+
+    @property
+    def r_ele(self):
+        return self.decode().r_ele
+
+    @property
+    def sense(self):
+        return self.decode().sense
+
+    def write(self, out, indent=0, initialIndent=0, comma=',', output='codes'):
+        self.decode().write(out, indent, initialIndent, comma, output)
 
 # Contains information about the entry, including definitions, origins, synonyms, antonyms, etc.
 # All fields have the following form:
 #
 # field: [string]*
 class Sense(Text):
+    __slots__ = ('stagk', 'stagr', 'pos', 'xref', 'ant', 'field', 'misc', 's_inf', 'lsource', 'dial', 'gloss')
+
     def __init__(self, stagk, stagr, pos, xref, ant, field, misc, s_inf, lsource, dial, gloss):
-        self.fields = {}
-        if (not len(stagk) == 0):
-            self.fields['stagk'] = Stagk(stagk) 
-        if (not len(stagr) == 0):
-            self.fields['stagr'] = Stagr(stagr)
-        if (not len(pos) == 0):
-            self.fields['pos'] = Pos(pos)
-        if (not len(xref) == 0):
-            self.fields['xref'] = Xref(xref)
-        if (not len(ant) == 0):
-            self.fields['ant'] = Ant(ant)
-        if (not len(field) == 0):
-            self.fields['field'] = Field(field)
-        if (not len(misc) == 0):
-            self.fields['misc'] = Misc(misc)
-        if (not len(s_inf) == 0):
-            self.fields['s_inf'] = S_inf(s_inf)
-        if (not len(lsource) == 0):
-            self.fields['lsource'] = Lsource(lsource)
-        if (not len(dial) == 0):
-            self.fields['dial'] = Dial(dial)
-        if (not len(gloss) == 0):
-            self.fields['gloss'] = Gloss(gloss)
-
-    def toString(self, indent=0, initialIndent=0):
+        self.stagk = tuple(stagk)
+        self.stagr = tuple(stagr)
+        self.pos = tuple(pos)
+        self.xref = tuple(xref)
+        self.ant = tuple(ant)
+        self.field = tuple(field)
+        self.misc = tuple(misc)
+        self.s_inf = tuple(s_inf)
+        self.lsource = tuple(lsource)
+        self.dial = tuple(dial)
+        self.gloss = tuple(gloss)
+
+    def __reduce__(self):
+        return (Sense, (self.stagk, self.stagr, self.pos, self.xref, self.ant, self.field, self.misc, self.s_inf, self.lsource, self.dial, self.gloss))
+
+    def write(self, out, indent=0, initialIndent=0, output='codes'):
         newline = self.getNewline(indent)
         whitespace1 = self.getWhitespace(indent, initialIndent-indent)
-        msg = '{'
+        out.write('{')
         addComma = False
-        for item in self.fields.items():
-            comma = ',' if addComma else ''
+        for fieldType in self.fieldTypes:
+            values = getattr(self, fieldType.name)
+            if len(values) == 0:
+                continue
+            if addComma:
+                out.write(',')
             addComma = True
-            value = item[1].toString(indent, initialIndent)
-            msg += '{comma}{value}'.format(comma=comma, value=value)
-        msg += '{newline}{whitespace1}}}'.format(newline=newline, whitespace1=whitespace1)
-        return msg
+            fieldType.write(out, values, indent, initialIndent, '', output)
+        out.write('{newline}{whitespace1}}}'.format(newline=newline, whitespace1=whitespace1))
 
 # Contains information about kanji in an entry (if kanji exists)
 # Has the following form:
@@ -111,265 +262,466 @@ class Sense(Text):
 # ke_inf: [string]*
 # ke_pri: [string]*
 class K_Ele(Text):
+    __slots__ = ('keb', 'ke_inf', 'ke_pri')
+
     def __init__(self, keb, ke_inf, ke_pri):
         self.keb = keb
-        self.ke_inf = Ke_inf(ke_inf)
-        self.ke_pri = Ke_pri(ke_pri)
+        self.ke_inf = tuple(ke_inf)
+        self.ke_pri = tuple(ke_pri)
+
+    def __reduce__(self):
+        return (K_Ele, (self.keb, self.ke_inf, self.ke_pri))
 
-    def toString(self, indent=0, initialIndent=0):
-        keb = self.keb.toString(indent, initialIndent, '')
-        ke_inf = self.ke_inf.toString(indent, initialIndent, ',')
-        ke_pri = self.ke_pri.toString(indent, initialIndent, ',')
+    def write(self, out, indent=0, initialIndent=0, output='codes'):
+        out.write('{')
+        Keb.write(out, self.keb, indent, initialIndent, '')
+        Ke_inf.write(out, self.ke_inf, indent, initialIndent, ',', output)
+        Ke_pri.write(out, self.ke_pri, indent, initialIndent, ',')
         newline = self.getNewline(indent)
         whitespace = self.getWhitespace(indent, initialIndent - indent)
-        msg = '{{{keb}{ke_inf}{ke_pri}{newline}{whitespace}}}'.format(keb = keb, ke_inf = ke_inf, ke_pri = ke_pri, newline=newline, whitespace=whitespace)
-        return msg
+        out.write('{newline}{whitespace}}}'.format(newline=newline, whitespace=whitespace))
 
 # Contains information about the reading of an entry
 # Has the following form:
 #
-# keb: int
-# ke_inf: [string]*
-# ke_pri: [string]*
+# reb: int
+# re_nokanji: bool
+# re_restr: [string]*
+# re_inf: [string]*
+# re_pri: [string]*
 class R_Ele(Text):
+    __slots__ = ('reb', 're_nokanji', 're_restr', 're_inf', 're_pri')
+
     def __init__(self, reb, re_nokanji, re_restr, re_inf, re_pri):
         self.reb = reb
-        self.re_nokanji = Re_nokanji(re_nokanji)
-        self.re_restr = Re_restr(re_restr)
-        self.re_inf = Re_inf(re_inf)
-        self.re_pri = Re_pri(re_pri)
-
-    def toString(self, indent=0, initialIndent=0):
-        reb = self.reb.toString(indent, initialIndent, '')
-        re_nokanji = self.re_nokanji.toString(indent, initialIndent, ',')
-        re_restr = self.re_restr.toString(indent, initialIndent, ',')
-        re_inf = self.re_inf.toString(indent, initialIndent, ',')
-        re_pri = self.re_pri.toString(indent, initialIndent, ',')
+        self.re_nokanji = re_nokanji
+        self.re_restr = tuple(re_restr)
+        self.re_inf = tuple(re_inf)
+        self.re_pri = tuple(re_pri)
+
+    def __reduce__(self):
+        return (R_Ele, (self.reb, self.re_nokanji, self.re_restr, self.re_inf, self.re_pri))
+
+    def write(self, out, indent=0, initialIndent=0, output='codes'):
+        out.write('{')
+        Reb.write(out, self.reb, indent, initialIndent, '')
+        Re_nokanji.write(out, self.re_nokanji, indent, initialIndent, ',')
+        Re_restr.write(out, self.re_restr, indent, initialIndent, ',')
+        Re_inf.write(out, self.re_inf, indent, initialIndent, ',', output)
+        Re_pri.write(out, self.re_pri, indent, initialIndent, ',')
         newline = self.getNewline(indent)
         whitespace = self.getWhitespace(indent, initialIndent - indent)
-        msg = '{{{reb}{re_nokanji}{re_restr}{re_inf}{re_pri}{newline}{whitespace}}}'.format(reb=reb, re_nokanji=re_nokanji, re_restr = re_restr, re_inf=re_inf, re_pri=re_pri, newline=newline, whitespace=whitespace)
-        return msg
+        out.write('{newline}{whitespace}}}'.format(newline=newline, whitespace=whitespace))
 
-# Will be used to process tags and connections between words
+# Tags declared as entities in the DTD (pos, misc, field, dial, ke_inf and re_inf values). Every entity is given a
+#   small integer id, in order of declaration, and the model keeps the ids. labels gives the text written for each id for
+#   each of entityOutputs: the entity name ('codes'), its description ('descriptions') or the id itself ('ids'). The
+#   output is chosen by whoever writes the entries, see Controller.setEntityOutput
 class Entities:
     def __init__(self):
         self.entities = {}
+        self.descriptions = {}
+        self.codes = []
+        self.ids = {}
+        self.labels = {output: [] for output in entityOutputs}
 
     def addEntityType(self, entityType, entityName):
         self.entities[entityType] = {'__name__': entityName}
 
     def addEntity(self, entityType, entityName, entityValue):
         self.entities[entityType][entityName] = entityValue
+        self.descriptions[entityName] = entityValue
+        id = self.getId(entityName)
+        for output, labels in self.labels.items():
+            labels[id] = self.getLabel(id, output)
+
+    # Entities missing from the DTD, or parsed without it as by EntryIndex, are given the next id when first seen
+    def getId(self, entityName) -> int:
+        id = self.ids.get(entityName)
+        if id is None:
+            id = len(self.codes)
+            self.ids[entityName] = id
+            self.codes.append(entityName)
+            for output, labels in self.labels.items():
+                labels.append(self.getLabel(id, output))
+        return id
+
+    def getLabel(self, id, output='codes') -> str:
+        if output == 'descriptions':
+            return self.descriptions.get(self.codes[id], self.codes[id]).replace('"', '\\"')
+        elif output == 'ids':
+            return str(id)
+        return self.codes[id]
 
-# Used for elements with a single value
+    # Writes the code and description of every id, as a JSON array indexed by id
+    def writeLegend(self, out):
+        out.write('[')
+        for id in range(len(self.codes)):
+            code = self.codes[id]
+            out.write('{comma}{{"code":"{code}","description":"{description}"}}'.format(comma=',' if id > 0 else '', code=code,
+                description=self.descriptions.get(code, code).replace('"', '\\"')))
+        out.write(']')
+
+# Ids of the tags of the entries parsed in this process, shared by all controllers so that entries from any of them
+#   can be written
+entityTable = Entities()
+
+# Used for elements with a single value. Never instantiated: the value is kept by the model as a string (or bool),
+#   subclasses only give the element's name
 class PCData(Text):
-    def __init__(self, name, value):
-        self.name = name
-        self.value = value
-        
-    def toString(self, indent=0, initialIndent=0, comma=''):
-        value= self.getValue()
-        if type(value) == bool:
-            if value == False:
-                return ''
-        elif value == None or len(value) == 0:
-            return ''
-        newline = self.getNewline(indent)
-        whitespace = self.getWhitespace(indent, initialIndent)
-        name = self.getName()
-        space = self.getSpace(indent)
-        msg = '{comma}{newline}{indent}"{name}":{space}"{value}"'.format(comma=comma, indent=whitespace, name=name, value=value, space=space, newline=newline)
-        return msg
+    name = None
 
-    def getValue(self):
-        if type(self.value) == bool:
-            return str(self.value).lower()  # Undo Python's boolean capitalization
-        elif type(self.value) == str:
-            return self.value.replace('"', '\\"')   # Make sure double quotes are escaped properly
-        else:
-            return self.value
+    @classmethod
+    def write(cls, out, value, indent=0, initialIndent=0, comma=''):
+        value= cls.getValue(value)
+        if value == None or len(value) == 0:
+            return
+        newline = cls.getNewline(indent)
+        whitespace = cls.getWhitespace(indent, initialIndent)
+        space = cls.getSpace(indent)
+        out.write('{comma}{newline}{indent}"{name}":{space}"{value}"'.format(comma=comma, indent=whitespace, name=cls.name, value=value, space=space, newline=newline))
 
-    def getName(self):
-        return self.name
+    @staticmethod
+    def getValue(value):
+        if type(value) == bool:
+            return str(value).lower()  # Undo Python's boolean capitalization
+        elif type(value) == str:
+            return value.replace('"', '\\"')   # Make sure double quotes are escaped properly
+        else:
+            return value
 
-# Used for elements with multiple values
+# Used for elements with multiple values, kept by the model as a tuple of strings
 class PCDataArray(PCData):
-    def __init__(self, name, values):
-        pcdata = []
-        for value in values:
-            pcdata.append(value)
-        super().__init__(name, pcdata)
-
-    def toString(self, indent=0, initialIndent=0, comma=''):
-        values = self.getValue()
-        if len(values) == 0: return ''
-        newline = self.getNewline(indent)
-        whitespace1 = self.getWhitespace(indent, initialIndent)
-        whitespace2 = self.getWhitespace(indent*2, initialIndent)
-        space = self.getSpace(indent)
-        name = self.getName()
-        msg = '{comma}{newline}{indent1}"{name}":{space}['.format(comma=comma, newline=newline, indent1=whitespace1, name=name, space=space)
-        for i in range(len(values)):
-            value = values[i].getValue()
-            msg += '{newline}{whitespace2}"{value}"'.format(newline = newline, whitespace2 = whitespace2, value=value)
-            msg += ',' if i < len(values) - 1 else ''
-        msg += "{newline}{indent1}]".format(newline=newline, indent1=whitespace1)
-        return msg
+    # output is only used by EntityArray
+    @classmethod
+    def write(cls, out, values, indent=0, initialIndent=0, comma='', output='codes'):
+        if len(values) == 0: return
+        getValue = cls.getValue
+        cls.writeValues(out, [getValue(value) for value in values], '"', indent, initialIndent, comma)
+
+    @classmethod
+    def writeValues(cls, out, values, quote, indent=0, initialIndent=0, comma=''):
+        newline = cls.getNewline(indent)
+        whitespace1 = cls.getWhitespace(indent, initialIndent)
+        whitespace2 = cls.getWhitespace(indent*2, initialIndent)
+        space = cls.getSpace(indent)
+        separator = ',{newline}{whitespace2}{quote}'.format(newline=newline, whitespace2=whitespace2, quote=quote)
+        out.write('{comma}{newline}{indent1}"{name}":{space}[{newline}{whitespace2}{quote}'.format(comma=comma, newline=newline, indent1=whitespace1, name=cls.name, space=space, whitespace2=whitespace2, quote=quote))
+        out.write('{quote}{separator}'.format(quote=quote, separator=separator).join(values))
+        out.write('{quote}{newline}{indent1}]'.format(quote=quote, newline=newline, indent1=whitespace1))
+
+# Used for elements whose values are entities, kept by the model as a tuple of ids from entityTable, and written as
+#   given by output, one of entityOutputs. Ids are written as numbers, other labels as strings
+class EntityArray(PCDataArray):
+    @classmethod
+    def write(cls, out, values, indent=0, initialIndent=0, comma='', output='codes'):
+        if len(values) == 0: return
+        labels = entityTable.labels[output]
+        quote = '' if output == 'ids' else '"'
+        cls.writeValues(out, [labels[value] for value in values], quote, indent, initialIndent, comma)
 
 # Id for a given entry
 class Ent_seq(PCData):
-    def __init__(self, value):
-        super().__init__('ent_seq', value)
+    name = 'ent_seq'
 
 # The writing of the element, if it contains kanji characters
 class Keb(PCData):
-    def __init__(self, value):
-        super().__init__('keb', value)
+    name = 'keb'
 
 # Field related to the orthography of the element
-class Ke_inf(PCDataArray):
-    def __init__(self, value):
-        super().__init__('ke_inf', value)
+class Ke_inf(EntityArray):
+    name = 'ke_inf'
 
 # Along with re_pri, will contain information about the 'relative priority of a word'
 # For instance, if the tag 'news1/news2' is present, that indicates the word is used often in news publications,
 #   and as such can be considered a 'highly used' word
 class Ke_pri(PCDataArray):
-    def __init__(self, value):
-        super().__init__('ke_pri', value)
+    name = 'ke_pri'
 
 # The reading of the element
 class Reb(PCData):
-    def __init__(self, value):
-        super().__init__('reb', value)
+    name = 'reb'
 
 # Indicates that the reb, while associated with the keb of an element, cannot be regarded as a true reading of the kanji
 class Re_nokanji(PCData):
-    def __init__(self, value):
-        super().__init__('re_nokanji', value)
+    name = 're_nokanji'
 
-    def toString(self, indent, initialIndent, comma):
-        if self.getValue():
-            return super(Re_nokanji, self).toString(indent, initialIndent, comma)
-        else:
-            return ''
-        
 # Used to indicate that the reading only applies to a subset of the keb elements in the entry
 class Re_restr(PCDataArray):
-    def __init__(self, value):
-        super().__init__('re_restr', value)
+    name = 're_restr'
 
 # Information pertaining to the specific reading. Typically will be used to indicate some unusual aspect of the reading
-class Re_inf(PCDataArray):
-    def __init__(self, value):
-        super().__init__('re_inf', value)
+class Re_inf(EntityArray):
+    name = 're_inf'
 
 # See Ke_pri
 class Re_pri(PCDataArray):
-    def __init__(self, value):
-        super().__init__('re_pri', value)
+    name = 're_pri'
 
 #
 class Stagk(PCDataArray):
-    def __init__(self, value):
-        super().__init__('stagk', value)
+    name = 'stagk'
 
 # If present, indicate that the sense is restricted to the lexeme represented by the keb and/or the reb
 class Stagr(PCDataArray):
-    def __init__(self, value):
-        super().__init__('stagr', value)
+    name = 'stagr'
 
 # Part of speech information about the entry. 
 # In general where there are multiple senses in an entry, the part-of-speech of an earlier sense will apply to
 #     later senses unless there is a new part-of-speech indicated.
-class Pos(PCDataArray):
-    def __init__(self, value):
-        super().__init__('pos', value)
+class Pos(EntityArray):
+    name = 'pos'
 
 # Used to indicate a cross-reference to another entry with a similar or related meaning or sense
 class Xref(PCDataArray):
-    def __init__(self, value):
-        super().__init__('xref', value)
+    name = 'xref'
 
 # Used to indicate another entry which is an antonym of the current entry/sense. The content of this element must exactly
 #     match that of a keb or reb element in another entry.
 class Ant(PCDataArray):
-    def __init__(self, value):
-        super().__init__('ant', value)
+    name = 'ant'
 
 # Information about the field of application of the entry/sense (computers, economics, music, etc.)
-class Field(PCDataArray):
-    def __init__(self, value):
-        super().__init__('field', value)
+class Field(EntityArray):
+    name = 'field'
 
 # This element is used for other relevant information about the entry/sense. As with part-of-speech, 
 #     information will usually apply to several senses.
-class Misc(PCDataArray):
-    def __init__(self, value):
-        super().__init__('misc', value)
+class Misc(EntityArray):
+    name = 'misc'
 
 # The sense-information elements provided for additional information to be recorded about a sense. Typical usage would
 #     be to indicate such things as level of currency of a sense, the regional variations, etc.
 class S_inf(PCDataArray):
-    def __init__(self, value):
-        super().__init__('s_inf', value)
+    name = 's_inf'
 
 # This element records the information about the source language(s) of a loan-word/gairaigo.
 # If the source language is other than English, the language is indicated by the xml:lang attribute
 class Lsource(PCDataArray):
-    def __init__(self, value):
-        super().__init__('lsource', value)
+    name = 'lsource'
 
 # For words specifically associated with regional dialects in Japanese, the entity code for that dialect, e.g. ksb for Kansaiben.
-class Dial(PCDataArray):
-    def __init__(self, value):
-        super().__init__('dial', value)
+class Dial(EntityArray):
+    name = 'dial'
 
 # Target-language words or phrases which are equivalents to the Japanese word defined in an entry.
 # This element would normally be present, however it may be omitted in entries which are purely for a cross-reference.
 class Gloss(PCDataArray):
-    def __init__(self, value):
-        super().__init__('gloss', value)
+    name = 'gloss'
+
+# Field types of Sense, in output order
+Sense.fieldTypes = (Stagk, Stagr, Pos, Xref, Ant, Field, Misc, S_inf, Lsource, Dial, Gloss)
+
+# Progress and timing of a run. This base class only keeps the figures, at a cost of one call every 1000 entries, and
+#   is what a controller uses by default; StatusLine and MetricsFile report them. Progress is measured on the byte
+#   offset reached in the file. Phases are timed separately: 'parse' (reading and parsing entries, which the parsers do
+#   line by line), 'serialize' (writing entries as JSON to the output), 'write' (flushing and closing the output, with
+#   its compression), 'snapshot', 'index' and, with several workers, 'convert'
+class Instrumentation:
+    # Streaming modes time parsing and serializing of every entry only when set, as this costs two clock reads per entry
+    timed = False
 
-class Controller(Text):
     def __init__(self):
-        self.entities = Entities()
+        self.start(0)
+
+    def start(self, size):
+        self.size = size
+        self.entries = 0
+        self.position = 0
+        self.phases = {}
+        self.epoch = time.perf_counter()
+
+    def progress(self, entries, position=None):
+        self.entries = entries
+        if position is not None:
+            self.position = position
+
+    def addTime(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def finish(self):
+        pass
+
+    def getMetrics(self) -> dict:
+        seconds = time.perf_counter() - self.epoch
+        return {
+            'entries': self.entries,
+            'bytes': self.position,
+            'size': self.size,
+            'seconds': seconds,
+            'entriesPerSecond': self.entries / seconds if seconds > 0 else 0,
+            'megabytesPerSecond': self.position / seconds / 1e6 if seconds > 0 else 0,
+            'phases': dict(self.phases),
+        }
+
+# Shows progress on a single terminal line, rewritten at most every interval seconds
+class StatusLine(Instrumentation):
+    timed = True
+
+    def __init__(self, out=sys.stderr, interval=0.5):
+        self.out = out
+        self.interval = interval
+        super().__init__()
+
+    def start(self, size):
+        super().start(size)
+        self.shown = 0
+
+    def progress(self, entries, position=None):
+        super().progress(entries, position)
+        now = time.perf_counter()
+        if now - self.shown >= self.interval:
+            self.shown = now
+            self.show()
+
+    def show(self):
+        metrics = self.getMetrics()
+        percent = '{percent:5.1f}% '.format(percent=100 * self.position / self.size) if self.size > 0 else ''
+        self.out.write('\r{percent}{entries} entries, {rate:.0f} entries/s, {throughput:.1f} MB/s'.format(percent=percent,
+            entries=self.entries, rate=metrics['entriesPerSecond'], throughput=metrics['megabytesPerSecond']))
+        self.out.flush()
+
+    def finish(self):
+        self.show()
+        phases = ', '.join(['{phase} {seconds:.2f}s'.format(phase=phase, seconds=seconds) for phase, seconds in self.phases.items()])
+        self.out.write('\n{phases}\n'.format(phases=phases))
+        self.out.flush()
+
+# Writes the final figures of the run to a JSON file
+class MetricsFile(Instrumentation):
+    timed = True
+
+    def __init__(self, path):
+        self.path = path
+        super().__init__()
+
+    def finish(self):
+        with open(self.path, "w", encoding="utf8") as write_file:
+            json.dump(self.getMetrics(), write_file, indent=2)
+
+# fields selects the fields that are parsed (see elementFields), all of them by default. Fields left out are never
+#   parsed nor allocated, and are empty in the model. languages, a list of xml:lang codes, keeps only the glosses in those
+#   languages (glosses without xml:lang are 'eng'), and drops the senses left without glosses
+class Controller(Text):
+    def __init__(self, parser='regex', instrumentation=None, fields=None, languages=None):
+        self.entities = entityTable
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
         self.entries = {}
+        # How entities are written by this controller, see setEntityOutput
+        self.entityOutput = 'codes'
+        self.headwords = {}
+        self.readings = []
+        self.glossIndex = None
+        self.graphNodes = None
+        self.lazySource = None
+        self.input_file = None
+        self.entryEnd = 0
+        self.count = 0
+        # Values of each tag of the element being read by the lexer parser. The lists are emptied as each element is
+        #   built, and reused for the next one
+        self.lexValues = {name: [] for name in lexKinds}
+        values = self.lexValues
+        # Lists of lexValues used by lexEntry: those of the elements of an entry, of ent_seq, and of the fields of k_ele,
+        #   r_ele and sense in model order
+        self.lexGroups = (values['k_ele'], values['r_ele'], values['sense'], values['ent_seq'],
+            [values[name] for name in elementFields['k_ele']], [values[name] for name in elementFields['r_ele']],
+            [values[name] for name in elementFields['sense']])
+        parsers = {'regex': self.processEntry, 'lexer': self.lexEntry, 'expat': None}
+        if parser not in parsers:
+            raise Exception(parser)
+        self.parser = parser
+        self.parseEntry = parsers[parser]
+        # Backend reading the entries of an open file: line by line with parseEntry, or with a streaming XML parser
+        self.readEntries = self.readExpat if parser == 'expat' else self.readLines
+        self.setFields(fields, languages)
+
+    def setFields(self, fields=None, languages=None):
+        allFields = [field for element in elementFields.values() for field in element]
+        if fields is None:
+            fields = allFields
+        selected = set()
+        for field in fields:
+            if field in elementFields:
+                selected.update(elementFields[field])
+            elif field in allFields:
+                selected.add(field)
+            elif field != 'ent_seq':
+                raise Exception(field)
+        elements = set()
+        for element, children in elementFields.items():
+            if not selected.isdisjoint(children):
+                elements.add(element)
+                if element != 'sense':
+                    selected.add(children[0])
+        self.fields = frozenset(selected)
+        self.keepK_Ele = 'keb' in selected
+        self.keepR_Ele = 'reb' in selected
+        self.keepSense = 'sense' in elements
+        self.languages = None if languages is None else frozenset(languages)
+        # Kind of each tag read by the lexer parser, see lexKinds, and the list of its values. Tags left out are not in
+        #   it. The table is rebuilt from lexKinds on every call, so that setFields can be called again on a controller
+        self.lexTable = {name: (kind, self.lexValues[name]) for name, kind in lexKinds.items()
+            if name == 'ent_seq' or name in selected or name in elements}
+        if self.languages is not None and 'gloss' in self.lexTable:
+            self.lexTable['gloss'] = ('gloss', self.lexValues['gloss'])
+
+    # Sets how the entries written by this controller give their entities, one of entityOutputs. Other controllers, which
+    #   share the entity table, are not affected
+    def setEntityOutput(self, output):
+        if output not in entityOutputs:
+            raise Exception(output)
+        self.entityOutput = output
+
+    # Language of a gloss, from the raw attributes of its tag
+    def getGlossLanguage(self, attributes) -> str:
+        if 'xml:lang' not in attributes:
+            return 'eng'
+        return self.getAttribute(attributes, 'xml:lang')
+
+    # Value of the attribute name, found in the raw attributes of a tag
+    @staticmethod
+    def getAttribute(attributes, name) -> str:
+        start = attributes.index(name + '="') + len(name) + 2
+        return attributes[start:attributes.index('"', start)]
 
     def addEntityType(self, line) -> str:
         line = re.sub(r'[<>]', '', line)
         words = line.split(' ')
         entityType = words[0]
-        entityName = words[1] if len(words) > 2 else words[0]
+        entityName = ' '.join(words[1:-1]) if len(words) > 2 else words[0]
         self.entities.addEntityType(entityType, entityName)
         return entityType
-        
-    def processEntities(self, line):
-        line = re.sub(r'<!-- | -->\n', '', line)
-        if '<' in line:
-            entityType = self.addEntityType(line)
+
+    # Reads the <!ENTITY name "description"> declarations following a '<!-- <type> ... entities -->' comment, and
+    #   those of the blocks right after it. Returns the first line that is not part of a block
+    def processEntities(self, line) -> str:
+        while line.startswith('<!-- <') and '-->' in line:
+            entityType = self.addEntityType(re.sub(r'<!-- | -->\n', '', line))
             line = self.read_file.readline()
-            while ('<!--' not in line):
-                line = re.sub(r'<!ENTITY |>', '', line)
-                words = line.split(' ', maxsplit=1)
-                entityName = words[0]
-                entityValue = words[1]
-                self.entities.addEntity(entityType, entityName, entityValue)
+            while line.startswith('<!ENTITY '):
+                words = line[9:].rstrip().rstrip('>').split(' ', maxsplit=1)
+                self.entities.addEntity(entityType, words[0], words[1].strip('"'))
                 line = self.read_file.readline()
-                
+        return line
+
+    # Id of the entity referred to by a line such as <pos>&n;</pos>
+    def parseEntity(self, line) -> int:
+        return self.entities.getId(line[line.index('&') + 1:line.index(';')])
+
     def parseEnt_seq(self, line) -> str:
-        return Ent_seq(re.sub(r'<[/]*ent_seq>(\n)*', '', line))
+        return re.sub(r'<[/]*ent_seq>(\n)*', '', line)
 
     def parseKeb(self, line) -> str:
-        return PCData('keb', re.sub(r'<[/]*keb>(\n)*', '', line))
+        return re.sub(r'<[/]*keb>(\n)*', '', line)
 
-    def parseKe_inf(self, line) -> str:
-        return PCData('ke_inf', re.sub(r'<[/]*ke_inf>(\n)*|&|;', '', line))
+    def parseKe_inf(self, line) -> int:
+        return self.parseEntity(line)
 
     def parseKe_pri(self, line) -> str:
-        return PCData('ke_pri', re.sub(r'<[/]*ke_pri>(\n)*', '', line))
+        return sys.intern(re.sub(r'<[/]*ke_pri>(\n)*', '', line))
 
     def processK_Ele(self):
+        fields = self.fields
         line = self.read_file.readline()
         keb = self.parseKeb(line)
         ke_inf = []
@@ -377,27 +729,37 @@ class Controller(Text):
         line = self.read_file.readline()
         while '</k_ele>' not in line:
             if 'ke_inf' in line:
-                ke_inf.append(self.parseKe_inf(line))
+                if 'ke_inf' in fields:
+                    ke_inf.append(self.parseKe_inf(line))
             elif 'ke_pri' in line:
-                ke_pri.append(self.parseKe_pri(line))
+                if 'ke_pri' in fields:
+                    ke_pri.append(self.parseKe_pri(line))
             line = self.read_file.readline()
         return K_Ele(keb, ke_inf, ke_pri)
 
+    # Reads past an element that is not parsed
+    def skipElement(self, name):
+        closing = '</' + name + '>'
+        line = self.read_file.readline()
+        while closing not in line and line != '':
+            line = self.read_file.readline()
+
 
 
     def parseReb(self, line) -> str:
-        return Reb(re.sub(r'<[/]*reb>(\n)*', '', line))
+        return re.sub(r'<[/]*reb>(\n)*', '', line)
     
     def parseRe_restr(self, line) -> str:
-        return PCData('re_restr', re.sub(r'<[/]*re_restr>(\n)*', '', line))
+        return re.sub(r'<[/]*re_restr>(\n)*', '', line)
     
     def parseRe_pri(self, line) -> str:
-        return PCData('re_pri', re.sub(r'<[/]*re_pri>(\n)*', '', line))
+        return sys.intern(re.sub(r'<[/]*re_pri>(\n)*', '', line))
     
-    def parseRe_inf(self, line) -> str:
-        return PCData('re_inf', re.sub(r'(;)*<[/]*re_inf>(\n)*(&)*', '', line))
+    def parseRe_inf(self, line) -> int:
+        return self.parseEntity(line)
     
     def processR_Ele(self):
+        fields = self.fields
         line = self.read_file.readline()
         reb = self.parseReb(line)
         line = self.read_file.readline()
@@ -406,55 +768,64 @@ class Controller(Text):
             line = self.read_file.readline()
         else:
             re_nokanji = False
+        if 're_nokanji' not in fields:
+            re_nokanji = None
         re_restr = []
         re_inf = []
         re_pri = []
         while '</r_ele>' not in line:
             if 're_restr' in line:
-                re_restr.append(self.parseRe_restr(line))
+                if 're_restr' in fields:
+                    re_restr.append(self.parseRe_restr(line))
             elif 're_inf' in line:
-                re_inf.append(self.parseRe_inf(line))
+                if 're_inf' in fields:
+                    re_inf.append(self.parseRe_inf(line))
             elif 're_pri' in line:
-                re_pri.append(self.parseRe_pri(line))
+                if 're_pri' in fields:
+                    re_pri.append(self.parseRe_pri(line))
             line = self.read_file.readline()
         return R_Ele(reb, re_nokanji, re_restr, re_inf, re_pri)
             
     
     def parseStagk(self, line) -> str:
-        return PCData('stagk', re.sub(r'<[/]*stagk>(\n)*', '', line))
+        return re.sub(r'<[/]*stagk>(\n)*', '', line)
     
     def parseStagr(self, line) -> str:
-        return PCData('stagr', re.sub(r'<[/]*stagr>(\n)*', '', line))
+        return re.sub(r'<[/]*stagr>(\n)*', '', line)
     
-    def parsePos(self, line) -> str:
-        return PCData('pos', re.sub(r'(;)*<[/]*pos>(\n)*(&)*', '', line))
+    def parsePos(self, line) -> int:
+        return self.parseEntity(line)
     
     def parseAnt(self, line) -> str:
-        return PCData('ant', re.sub(r'<[/]*ant>(\n)*', '', line))
+        return re.sub(r'<[/]*ant>(\n)*', '', line)
     
-    def parseField(self, line) -> str:
-        return PCData('field', re.sub(r'(;)*<[/]*field>(\n)*(&)*', '', line))
+    def parseField(self, line) -> int:
+        return self.parseEntity(line)
     
-    def parseMisc(self, line) -> str:
-        return PCData('misc', re.sub(r'(;)*<[/]*misc>(\n)*(&)*', '', line))
+    def parseMisc(self, line) -> int:
+        return self.parseEntity(line)
     
     def parseS_inf(self, line) -> str:
-        return PCData('s_inf', re.sub(r'<[/]*s_inf>(\n)*', '', line))
+        return re.sub(r'<[/]*s_inf>(\n)*', '', line)
     
     def parseLsource(self, line) -> str:
         if 'xml:lang' in line:
-            return PCData('lsource', re.search(r'xml:lang="([a-z]*)"', line).group(1))
+            return sys.intern(re.search(r'xml:lang="([a-z]*)"', line).group(1))
 
-    def parseDial(self, line) -> str:
-        return PCData('dial', re.sub(r'(;)*<[/]*dial>(\n)*(&)*', '', line))
+    def parseDial(self, line) -> int:
+        return self.parseEntity(line)
     
     def parseGloss(self, line) -> str:
-        return PCData('gloss', re.sub(r'<[/]*gloss(?:[^>])*>(\n)*', '', line))
+        return re.sub(r'<[/]*gloss(?:[^>])*>(\n)*', '', line)
     
     def parseXref(self, line) -> str:
-        return PCData('xref', re.sub(r'<[/]*xref>(\n)*', '', line))
+        return re.sub(r'<[/]*xref>(\n)*', '', line)
     
+    # Returns None for a sense whose glosses are all in other languages than self.languages
     def processSense(self):
+        fields = self.fields
+        languages = self.languages
+        filtered = False
         stagk = []
         stagr = []
         pos = []
@@ -469,28 +840,44 @@ class Controller(Text):
         line = self.read_file.readline()
         while '</sense>' not in line:
             if '<stagk' in line:
-                stagk.append(self.parseStagk(line))
+                if 'stagk' in fields:
+                    stagk.append(self.parseStagk(line))
             elif '<stagr' in line:
-                stagr.append(self.parseStagr(line))
+                if 'stagr' in fields:
+                    stagr.append(self.parseStagr(line))
             elif '<pos' in line:
-                pos.append(self.parsePos(line))
+                if 'pos' in fields:
+                    pos.append(self.parsePos(line))
             elif '<xref' in line:
-                xref.append(self.parseXref(line))
+                if 'xref' in fields:
+                    xref.append(self.parseXref(line))
             elif '<ant' in line:
-                ant.append(self.parseAnt(line))
+                if 'ant' in fields:
+                    ant.append(self.parseAnt(line))
             elif '<field' in line:
-                field.append(self.parseField(line))
+                if 'field' in fields:
+                    field.append(self.parseField(line))
             elif '<misc' in line:
-                misc.append(self.parseMisc(line))
+                if 'misc' in fields:
+                    misc.append(self.parseMisc(line))
             elif '<s_inf' in line:
-                s_inf.append(self.parseS_inf(line))
+                if 's_inf' in fields:
+                    s_inf.append(self.parseS_inf(line))
             elif '<lsource' in line and 'xml:lang' in line:
-                lsource.append(self.parseLsource(line))
+                if 'lsource' in fields:
+                    lsource.append(self.parseLsource(line))
             elif '<dial' in line:
-                dial.append(self.parseDial(line))
+                if 'dial' in fields:
+                    dial.append(self.parseDial(line))
             elif '<gloss' in line:
-                gloss.append(self.parseGloss(line))
+                if 'gloss' in fields:
+                    if languages is None or self.getGlossLanguage(line[:line.index('>')]) in languages:
+                        gloss.append(self.parseGloss(line))
+                    else:
+                        filtered = True
             line = self.read_file.readline()
+        if filtered and len(gloss) == 0:
+            return None
         return Sense(stagk, stagr, pos, xref, ant, field, misc, s_inf, lsource, dial, gloss)
     
     def processEntry(self, lowMemory=False):
@@ -499,133 +886,1255 @@ class Controller(Text):
         line = self.read_file.readline()
         k_ele = []
         r_ele = []
-        if self.count == 1000:
-            pdb.set_trace()
         sense = []
-        self.count += 1
         while '</entry>' not in line:
             if 'k_ele' in line:
-                k_ele.append(self.processK_Ele())
+                if self.keepK_Ele:
+                    k_ele.append(self.processK_Ele())
+                else:
+                    self.skipElement('k_ele')
             elif 'r_ele' in line:
-                r_ele.append(self.processR_Ele())
+                if self.keepR_Ele:
+                    r_ele.append(self.processR_Ele())
+                else:
+                    self.skipElement('r_ele')
             elif 'sense' in line:
-                sense.append(self.processSense())
+                if self.keepSense:
+                    value = self.processSense()
+                    if value is not None:
+                        sense.append(value)
+                else:
+                    self.skipElement('sense')
             line = self.read_file.readline()
         entry = Entry(ent_seq, k_ele, r_ele, sense)
         if (lowMemory):
             return entry
-        self.entries[ent_seq.getValue()] = entry
+        self.entries[ent_seq] = entry
 
-    def loadDict(self, filename):
-        self.count = 0
-        self.read_file = open(filename, "r", encoding="utf8")
-##          DON'T USE READLINES - No need to load into memory
-        line = self.read_file.readline()
+    # Equivalent of processEntry in a single loop over the lines of the entry. The tag name of each line is looked up in
+    #   lexTable, and its text is read as the table says and added to the values of the tag in lexValues until the
+    #   closing tag of its element. Only tags with attributes are split further. Elements left out by setFields are
+    #   skipped up to their closing tag. Lines may be indented, but each element is expected on its own line, as in the
+    #   JMdict file
+    def lexEntry(self, lowMemory=False):
+        readline = self.read_file.readline
+        lexTable = self.lexTable
+        getId = self.entities.getId
+        languages = self.languages
+        keepNokanji = 're_nokanji' in self.fields
+        k_ele, r_ele, sense, ent_seq_values, kanjiValues, readingValues, senseValues = self.lexGroups
+        keb, ke_inf, ke_pri = kanjiValues
+        reb, re_nokanji, re_restr, re_inf, re_pri = readingValues
+        gloss = senseValues[-1]
+        # Closing tag of the element being skipped, and whether a gloss of the current sense was filtered out
+        skip = None
+        filtered = False
+        line = readline()
+        while line != '':
+            if line[0] != '<':
+                line = line.lstrip() or '  '
+            if line[1] == '/':
+                name = line[2:line.find('>')]
+                if skip is not None:
+                    if name == skip:
+                        skip = None
+                elif name == 'sense':
+                    if not filtered or len(gloss) > 0:
+                        sense.append(Sense(*senseValues))
+                    filtered = False
+                    # Most fields of a sense are empty
+                    for children in senseValues:
+                        if children:
+                            children.clear()
+                elif name == 'r_ele':
+                    r_ele.append(R_Ele(reb[0], len(re_nokanji) > 0 if keepNokanji else None, re_restr, re_inf, re_pri))
+                    for children in readingValues:
+                        if children:
+                            children.clear()
+                elif name == 'k_ele':
+                    k_ele.append(K_Ele(keb[0], ke_inf, ke_pri))
+                    for children in kanjiValues:
+                        if children:
+                            children.clear()
+                elif name == 'entry':
+                    break
+            elif skip is None:
+                end = line.find('>')
+                tag = lexTable.get(line[1:end])
+                attributes = ''
+                if tag is None:
+                    name, _, attributes = line[1:end].partition(' ')
+                    name = name.rstrip('/')
+                    tag = lexTable.get(name)
+                    if tag is None:
+                        if name in elementFields:
+                            skip = name
+                        line = readline()
+                        continue
+                kind, children = tag
+                if kind == 'text':
+                    children.append(line[end + 1:line.rfind('<')])
+                elif kind == 'entity':
+                    children.append(getId(line[end + 1:line.rfind('<')].lstrip('&').rstrip(';')))
+                elif kind == 'code':
+                    children.append(sys.intern(line[end + 1:line.rfind('<')]))
+                elif kind == 'gloss':
+                    if self.getGlossLanguage(attributes) in languages:
+                        children.append(line[end + 1:line.rfind('<')])
+                    else:
+                        filtered = True
+                elif kind == 'lsource':
+                    if 'xml:lang' in attributes:
+                        children.append(sys.intern(self.getAttribute(attributes, 'xml:lang')))
+            line = readline()
+        ent_seq = ent_seq_values[0]
+        ent_seq_values.clear()
+        entry = Entry(ent_seq, k_ele, r_ele, sense)
+        k_ele.clear()
+        r_ele.clear()
+        sense.clear()
+        if (lowMemory):
+            return entry
+        self.entries[ent_seq] = entry
+
+    # Yields the entries of a JMdict file one at a time, without keeping them in memory. source is the path of the file or
+    #   a file object, compressed or not, as taken by openInput. Entity definitions are added to self.entities as they are read
+    #   With offset, a position given by getEntryEnd, reading starts from there, after the entities were read by processHeader.
+    #   The parsers read from self.read_file, so it is set back to the file of this iteration every time it resumes, in case
+    #   another iteration on the same controller was advanced in between
+    def iterEntries(self, source, offset=None):
+        read_file = self.openInput(source, self.parser == 'expat')
+        input_file = self.input_file
+        try:
+            if offset is not None:
+                read_file.seek(offset)
+            entries = self.readEntries(read_file)
+            while True:
+                self.read_file = read_file
+                self.input_file = input_file
+                entry = next(entries, None)
+                if entry is None:
+                    break
+                yield entry
+        finally:
+            self.read_file = read_file
+            self.input_file = input_file
+            self.closeInput(source, read_file)
+
+    # Opens source for reading, as text or as bytes with binary. source is the path of a file, a file object opened in
+    #   binary mode such as sys.stdin.buffer or a pipe, or a text file object, which is read as it is. gzip, bz2 and xz
+    #   files are recognized by their first bytes and decompressed as they are read. self.input_file is left on the
+    #   file as stored, so that progress is given in bytes of the input
+    def openInput(self, source, binary=False):
+        if isinstance(source, (str, os.PathLike)):
+            input_file = open(source, "rb", buffering=inputBufferSize)
+        elif isinstance(source, io.TextIOBase):
+            self.input_file = None
+            return source
+        else:
+            input_file = source
+        self.input_file = input_file
+        read_file = input_file
+        compression = self.getCompression(input_file)
+        if compression is not None:
+            read_file = compression.open(input_file, "rb")
+        if not binary:
+            read_file = io.TextIOWrapper(read_file, encoding="utf8")
+        return read_file
+
+    # Closes what openInput opened. A file object given as source is left open
+    def closeInput(self, source, read_file):
+        if read_file is source:
+            return
+        if isinstance(source, (str, os.PathLike)):
+            read_file.close()
+            self.input_file.close()
+            return
+        if isinstance(read_file, io.TextIOWrapper):
+            read_file = read_file.detach()
+        if read_file is not source:
+            read_file.close()
+
+    # Module decompressing the binary file object input_file, found from its first bytes without consuming them, or None
+    #   if it is not compressed. Streams that can neither peek nor seek are taken as not compressed
+    def getCompression(self, input_file):
+        if hasattr(input_file, 'peek'):
+            magic = input_file.peek(6)[:6]
+        elif input_file.seekable():
+            position = input_file.tell()
+            magic = input_file.read(6)
+            input_file.seek(position)
+        else:
+            return None
+        for prefix, module in inputCompressions:
+            if magic.startswith(prefix):
+                return module
+        return None
+
+    # Modes reading the file at random offsets need it uncompressed
+    def checkUncompressed(self, filename):
+        with open(filename, "rb") as read_file:
+            if self.getCompression(read_file) is not None:
+                raise Exception('{filename} is compressed, decompress it first'.format(filename=filename))
+
+    # Size in bytes of the input as stored, or 0 when it is not known, as for a pipe
+    def getInputSize(self, source) -> int:
+        if isinstance(source, (str, os.PathLike)):
+            return os.path.getsize(source)
+        try:
+            return os.fstat(source.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return 0
+
+    # Backend of the regex and lexer parsers, which expect one element per line as in the JMdict file
+    def readLines(self, read_file):
+##      DON'T USE READLINES - No need to load into memory
+        line = read_file.readline()
         while (line != ''):
+            if line.startswith('<!-- <'):
+                line = self.processEntities(line)
+                continue
             if ('<!-- ' in line):
-                if ('-->' in line):
-                    self.processEntities(line)
                 while ('-->' not in line):
-                    line = self.read_file.readline()
+                    line = read_file.readline()
             elif '<entry>' in line:
-                self.processEntry()
+                yield self.parseEntry(lowMemory=True)
+            line = read_file.readline()
+
+    # Backend of the expat parser, which reads any well-formed file whatever its layout, chunkSize bytes (or characters)
+    #   at a time. Entities are added to self.entities as expat reads the DTD, the type of each block being given by the
+    #   comment before it. Setting a default handler keeps expat from expanding entity references, which are reported as
+    #   skipped entities and kept as ids. Text is escaped again as it is in the file, which is what the line parsers keep,
+    #   so that every parser builds the same entries. Files of whole entries without the DTD or root element, as read by EntryIndex
+    #   and saveParallel, are wrapped in a root element, and their entities are looked up by name
+    def readExpat(self, read_file, chunkSize=1 << 20):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.UseForeignDTD(True)
+        parser.ExternalEntityRefHandler = lambda *args: 1
+        parser.buffer_text = True
+        parser.buffer_size = 1 << 16
+        parser.ordered_attributes = True
+        # Only attributes written in the file, as the other parsers see them, and not the defaults of the DTD such as
+        #   xml:lang="eng" on lsource
+        parser.specified_attributes = True
+        entities = self.entities
+        languages = self.languages
+        keepNokanji = 're_nokanji' in self.fields
+        # How the text of each kept leaf element is stored: as is, as an entity id, interned, or by attribute
+        leaves = {}
+        for name in self.lexTable:
+            if name in ('ke_inf', 're_inf', 'pos', 'field', 'misc', 'dial'):
+                leaves[name] = 'entity'
+            elif name in ('ke_pri', 're_pri', 'gloss', 'lsource'):
+                leaves[name] = name[3:] if name.endswith('_pri') else name
+            elif name not in ('k_ele', 'r_ele', 'sense'):
+                leaves[name] = 'text'
+        containers = {name for name in ('k_ele', 'r_ele', 'sense') if name in self.lexTable}
+        containers.add('entry')
+        entries = []
+        # Byte offset of the end of each entry in entries, from the start of what was given to expat
+        ends = []
+        # Children of the open entry, k_ele, r_ele and sense elements, by tag name
+        stack = []
+        text = []
+        # Depth inside an element left out by setFields, the open leaf element and its attributes, the current entity
+        #   type, and whether the root element was closed
+        skip = 0
+        leaf = None
+        leafAttributes = None
+        entityType = None
+        closed = False
+
+        def startElement(name, attributes):
+            nonlocal skip, leaf, leafAttributes
+            if skip > 0:
+                skip += 1
+            elif name in leaves:
+                leaf = name
+                leafAttributes = attributes
+                text.clear()
+            elif name in containers:
+                stack.append(defaultdict(list))
+            elif name != 'JMdict':
+                skip = 1
+
+        def endElement(name):
+            nonlocal skip, leaf, closed
+            if skip > 0:
+                skip -= 1
+                return
+            if leaf is not None:
+                kind = leaves[leaf]
+                value = ''.join(text)
+                if '&' in value or '<' in value or '>' in value:
+                    value = xml.sax.saxutils.escape(value)
+                if kind == 'entity':
+                    value = entities.getId(value)
+                elif kind == 'pri':
+                    value = sys.intern(value)
+                elif kind == 'gloss':
+                    if languages is not None and self.getExpatLanguage(leafAttributes, 'eng') not in languages:
+                        value = False
+                elif kind == 'lsource':
+                    value = self.getExpatLanguage(leafAttributes, None)
+                    if value is None:
+                        leaf = None
+                        return
+                    value = sys.intern(value)
+                stack[-1][leaf].append(value)
+                leaf = None
+                return
+            if name == 'JMdict':
+                closed = True
+                return
+            children = stack.pop()
+            get = children.get
+            if name == 'entry':
+                entries.append(Entry(children['ent_seq'][0], get('k_ele', []), get('r_ele', []), get('sense', [])))
+                # The end tag starts at CurrentByteIndex and is 8 bytes long
+                ends.append(parser.CurrentByteIndex + 8)
+            elif name == 'k_ele':
+                stack[-1]['k_ele'].append(K_Ele(children['keb'][0], get('ke_inf', []), get('ke_pri', [])))
+            elif name == 'r_ele':
+                re_nokanji = ('re_nokanji' in children) if keepNokanji else None
+                stack[-1]['r_ele'].append(R_Ele(children['reb'][0], re_nokanji, get('re_restr', []), get('re_inf', []), get('re_pri', [])))
+            elif name == 'sense':
+                if languages is not None and 'gloss' in children:
+                    gloss = [value for value in children['gloss'] if value is not False]
+                    if len(gloss) == 0:
+                        return
+                    children['gloss'] = gloss
+                stack[-1]['sense'].append(Sense(get('stagk', []), get('stagr', []), get('pos', []), get('xref', []), get('ant', []),
+                    get('field', []), get('misc', []), get('s_inf', []), get('lsource', []), get('dial', []), get('gloss', [])))
+
+        def characterData(data):
+            if leaf is not None:
+                text.append(data)
+
+        def skippedEntity(name, isParameterEntity):
+            if leaf is not None:
+                text.append(name)
+
+        def comment(data):
+            nonlocal entityType
+            data = data.strip()
+            if data.startswith('<'):
+                entityType = self.addEntityType(data)
+
+        def entityDecl(name, isParameterEntity, value, base, systemId, publicId, notationName):
+            if not isParameterEntity and value is not None and entityType is not None:
+                entities.addEntity(entityType, name, value)
+
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+        parser.CharacterDataHandler = characterData
+        parser.SkippedEntityHandler = skippedEntity
+        parser.CommentHandler = comment
+        parser.EntityDeclHandler = entityDecl
+        parser.DefaultHandler = lambda data: None
+        base = read_file.tell() if read_file.seekable() else 0
+        chunk = read_file.read(chunkSize)
+        if len(chunk) == 0:
+            return
+        wrapped = chunk.lstrip()[:7] in ('<entry>', b'<entry>')
+        if wrapped:
+            parser.Parse('<JMdict>', False)
+            base -= len('<JMdict>')
+        while len(chunk) > 0:
+            parser.Parse(chunk, False)
+            for entry, end in zip(entries, ends):
+                self.entryEnd = base + end
+                yield entry
+            entries.clear()
+            ends.clear()
+            chunk = read_file.read(chunkSize)
+        # The last fragment of a file closes the root element itself
+        parser.Parse('</JMdict>' if wrapped and not closed else '', True)
+        for entry, end in zip(entries, ends):
+            self.entryEnd = base + end
+            yield entry
+
+    # Value of the xml:lang attribute in the [name, value, ...] list given by expat, or default
+    @staticmethod
+    def getExpatLanguage(attributes, default):
+        for i in range(0, len(attributes), 2):
+            if attributes[i] == 'xml:lang':
+                return attributes[i + 1]
+        return default
+
+    # When a snapshot path is given, the entries are loaded from it if it was made from the same file content, and the
+    #   snapshot is (re)written after parsing otherwise. With lazy, entries are LazyEntry objects parsed on first access,
+    #   kept once parsed if cache is set, and the headword index is built on first use
+    def loadDict(self, filename, snapshot=None, lazy=False, cache=True):
+        if lazy and snapshot is not None:
+            raise Exception('Snapshots are not used with lazy loading')
+        if snapshot is not None and not isinstance(filename, (str, os.PathLike)):
+            raise Exception('Snapshots need the path of the JMdict file')
+        instrumentation = self.instrumentation
+        instrumentation.start(self.getInputSize(filename))
+        epoch = time.perf_counter()
+        loaded = False
+        if snapshot is not None:
+            sourceHash = self.hashFile(filename)
+            loaded = self.loadSnapshot(snapshot, sourceHash)
+            epoch = self.timePhase('snapshot', epoch)
+        if lazy:
+            self.loadLazy(filename, cache)
+            instrumentation.progress(len(self.entries), instrumentation.size)
+            self.timePhase('parse', epoch)
+            return
+        if not loaded:
+            self.count = 0
+            for entry in self.iterEntries(filename):
+                self.entries[entry.ent_seq] = entry
                 self.count += 1
                 if self.count % 1000 == 0:
-                    self.printStatus()
-            try:
-                line = self.read_file.readline()
-            except Exception:
-                line = None
-
-    def printStatus(self):
-        os.system('cls' if os.name=='nt' else 'clear')
-        print(str(math.floor((self.count / 382000)*100)) + '% done')
-        print(self.count)
-
-    def saveInPlace(self, filename, indent=0, initialIndent=0):
-        write_file = open('output.json', "w", encoding="utf8")
-        write_file.write("")
-        write_file.close()
+                    instrumentation.progress(self.count, self.getPosition())
+            epoch = self.timePhase('parse', epoch)
+            if snapshot is not None:
+                self.saveSnapshot(snapshot, sourceHash)
+                epoch = self.timePhase('snapshot', epoch)
+        instrumentation.progress(len(self.entries), instrumentation.size)
+        self.buildHeadwordIndex()
+        self.timePhase('index', epoch)
+
+    # Reads the entity definitions of the header, then finds every entry in the mapped file without parsing it
+    def loadLazy(self, filename, cache=True):
+        self.checkUncompressed(filename)
+        self.processHeader(filename)
+        self.lazySource = LazySource(filename, self.parser, self.fields, self.languages, cache)
+        for match in entryPattern.finditer(self.lazySource.source):
+            ent_seq = match.group(1).decode("ascii")
+            self.entries[ent_seq] = LazyEntry(ent_seq, self.lazySource, match.start(), match.end() - match.start())
+        self.headwords = None
+        self.readings = None
+
+    # Adds the time elapsed since epoch to phase. Returns the current time, the start of the next phase
+    def timePhase(self, phase, epoch) -> float:
+        now = time.perf_counter()
+        self.instrumentation.addTime(phase, now - epoch)
+        return now
+
+    # Position in the file being parsed just after the last entry given by iterEntries, to be passed back to it as offset.
+    #   It is the byte offset with the expat parser, and the position given by tell for the line parsers
+    def getEntryEnd(self) -> int:
+        if self.parser == 'expat':
+            return self.entryEnd
+        return self.read_file.tell()
+
+    # Byte offset reached in the file being parsed, or None if it is not known
+    def getPosition(self):
+        buffer = self.input_file if self.input_file is not None else getattr(self.read_file, 'buffer', self.read_file)
+        if isinstance(buffer, io.BufferedIOBase) and not buffer.closed and buffer.seekable():
+            return buffer.tell()
+        return None
+
+    # Maps every keb and reb to the ent_seqs of the entries using it, and keeps the distinct readings sorted so that
+    #   prefix searches are a binary search followed by a scan of the matches
+    def buildHeadwordIndex(self):
+        headwords = defaultdict(dict)
+        for entry in self.entries.values():
+            for k_ele in entry.k_ele:
+                headwords[k_ele.keb][entry.ent_seq] = None
+            for r_ele in entry.r_ele:
+                headwords[r_ele.reb][entry.ent_seq] = None
+        self.headwords = {headword: tuple(ent_seqs) for headword, ent_seqs in headwords.items()}
+        self.readings = sorted({r_ele.reb for entry in self.entries.values() for r_ele in entry.r_ele})
+
+    # Priority of an entry, from the ke_pri/re_pri codes of its best kanji or reading element: news1/ichi1/spec1/gai1
+    #   count 20, their 2 counterparts 10, and nfxx 50 - xx, so that the 500 most frequent words get the highest bonus
+    def getPriority(self, entry) -> int:
+        best = 0
+        for pri in [k_ele.ke_pri for k_ele in entry.k_ele] + [r_ele.re_pri for r_ele in entry.r_ele]:
+            score = 0
+            for code in pri:
+                if code.startswith('nf'):
+                    score += 50 - int(code[2:])
+                else:
+                    score += priorityScores.get(code, 0)
+            best = max(best, score)
+        return best
+
+    def getGlossTokens(self, text) -> list:
+        return self.glossTokenPattern.findall(text.lower())
+
+    # Builds an inverted index from gloss tokens to (entry, sense) postings. Entries are numbered by decreasing
+    #   priority, and a posting is (number << senseBits) | sense index, so postings sorted in increasing order are also
+    #   sorted by rank and the best matches are simply the first ones. Each token's postings are stored as deltas in the
+    #   smallest array type that holds them
+    def buildGlossIndex(self):
+        self.glossTokenPattern = re.compile(r'\w+')
+        self.glossRanking = sorted(self.entries, key=lambda ent_seq: -self.getPriority(self.entries[ent_seq]))
+        maxSenses = max([len(entry.sense) for entry in self.entries.values()], default=1)
+        self.senseBits = max(1, (maxSenses - 1).bit_length())
+        postings = defaultdict(list)
+        for number in range(len(self.glossRanking)):
+            senses = self.entries[self.glossRanking[number]].sense
+            for i in range(len(senses)):
+                posting = (number << self.senseBits) | i
+                for token in set(self.getGlossTokens(' '.join(senses[i].gloss))):
+                    postings[token].append(posting)
+        self.glossIndex = {}
+        for token, values in postings.items():
+            deltas = [values[0]] + [values[i] - values[i - 1] for i in range(1, len(values))]
+            largest = max(deltas)
+            typecode = 'B' if largest < 1 << 8 else 'H' if largest < 1 << 16 else 'I' if largest < 1 << 32 else 'Q'
+            self.glossIndex[token] = array(typecode, deltas)
+
+    # Finds the senses whose glosses contain every word of query, best ranked entries first. Returns a list of
+    #   (entry, sense index) pairs. The index is built on first use
+    def searchGlosses(self, query, limit=10) -> list:
+        if self.glossIndex is None:
+            self.buildGlossIndex()
+        tokens = set(self.getGlossTokens(query))
+        if len(tokens - glossStopwords) > 0:
+            tokens -= glossStopwords
+        if len(tokens) == 0:
+            return []
+        postings = [self.glossIndex.get(token) for token in tokens]
+        if None in postings:
+            return []
+        # Walks all posting lists together, decoding only as far as needed to find limit common postings
+        iterators = [itertools.accumulate(values) for values in postings]
+        current = [next(iterator) for iterator in iterators]
+        matches = []
+        try:
+            while limit is None or len(matches) < limit:
+                target = max(current)
+                for i in range(len(iterators)):
+                    while current[i] < target:
+                        current[i] = next(iterators[i])
+                if current.count(target) == len(current):
+                    matches.append(target)
+                    current[0] = next(iterators[0])
+        except StopIteration:
+            pass
+        mask = (1 << self.senseBits) - 1
+        return [(self.entries[self.glossRanking[posting >> self.senseBits]], posting & mask) for posting in matches]
+
+    # Entries with a keb or reb exactly matching headword
+    def lookupHeadword(self, headword) -> list:
+        if self.headwords is None:
+            self.buildHeadwordIndex()
+        return [self.entries[ent_seq] for ent_seq in self.headwords.get(headword, ())]
+
+    # Readings starting with prefix, in sorted order. Pass them to lookupHeadword to get the entries
+    def searchReadings(self, prefix, limit=None) -> list:
+        if self.headwords is None:
+            self.buildHeadwordIndex()
+        readings = self.readings
+        matches = []
+        i = bisect.bisect_left(readings, prefix)
+        while i < len(readings) and readings[i].startswith(prefix) and (limit is None or len(matches) < limit):
+            matches.append(readings[i])
+            i += 1
+        return matches
+
+    # Resolves an xref or ant, such as keb, reb, keb・reb, keb・2 or keb・reb・2, to the ent_seq of the first entry using
+    #   both headwords and the index of the numbered sense (or -1). Returns None when no such entry or sense exists
+    def resolveReference(self, reference) -> tuple:
+        parts = reference.split('・')
+        sense = -1
+        if len(parts) > 1 and parts[-1].isdigit():
+            sense = int(parts.pop()) - 1
+        candidates = self.headwords.get(parts[0], ())
+        for headword in parts[1:]:
+            candidates = [ent_seq for ent_seq in candidates if ent_seq in self.headwords.get(headword, ())]
+        for ent_seq in candidates:
+            if sense < len(self.entries[ent_seq].sense):
+                return ent_seq, sense
+        return None
+
+    # Resolves every xref and ant into a graph between entries, numbered in self.entries order. Edges are kept in CSR
+    #   form: the edges of entry n are graphOffsets[n] to graphOffsets[n + 1] in the parallel arrays graphSources,
+    #   graphSenses (sense of the reference), graphTargets, graphTargetSenses (-1 when the whole entry is referred to)
+    #   and graphKinds (0 for xref, 1 for ant). reverseOffsets and reverseEdges list the edges pointing to each entry.
+    #   References that could not be resolved are kept in unresolvedReferences as (ent_seq, sense, kind, reference)
+    def buildGraph(self):
+        if self.headwords is None:
+            self.buildHeadwordIndex()
+        self.graphNodes = list(self.entries)
+        self.graphNumbers = {ent_seq: number for number, ent_seq in enumerate(self.graphNodes)}
+        self.graphOffsets = array('I', [0])
+        self.graphSources = array('I')
+        self.graphSenses = array('H')
+        self.graphTargets = array('I')
+        self.graphTargetSenses = array('h')
+        self.graphKinds = array('B')
+        self.unresolvedReferences = []
+        resolved = {}
+        for number in range(len(self.graphNodes)):
+            ent_seq = self.graphNodes[number]
+            senses = self.entries[ent_seq].sense
+            for i in range(len(senses)):
+                for kind, references in ((0, senses[i].xref), (1, senses[i].ant)):
+                    for reference in references:
+                        if reference not in resolved:
+                            resolved[reference] = self.resolveReference(reference)
+                        target = resolved[reference]
+                        if target is None:
+                            self.unresolvedReferences.append((ent_seq, i, graphKindNames[kind], reference))
+                            continue
+                        self.graphSources.append(number)
+                        self.graphSenses.append(i)
+                        self.graphTargets.append(self.graphNumbers[target[0]])
+                        self.graphTargetSenses.append(target[1])
+                        self.graphKinds.append(kind)
+            self.graphOffsets.append(len(self.graphTargets))
+        counts = array('I', bytes(4 * (len(self.graphNodes) + 1)))
+        for target in self.graphTargets:
+            counts[target + 1] += 1
+        self.reverseOffsets = array('I', itertools.accumulate(counts))
+        self.reverseEdges = array('I', bytes(4 * len(self.graphTargets)))
+        filled = array('I', self.reverseOffsets[:-1])
+        for edge in range(len(self.graphTargets)):
+            target = self.graphTargets[edge]
+            self.reverseEdges[filled[target]] = edge
+            filled[target] += 1
+
+    def getEdge(self, edge) -> tuple:
+        targetSense = self.graphTargetSenses[edge]
+        return (self.graphNodes[self.graphSources[edge]], self.graphSenses[edge], self.graphNodes[self.graphTargets[edge]],
+            None if targetSense == -1 else targetSense, graphKindNames[self.graphKinds[edge]])
+
+    # References made by the entry, as (ent_seq, sense, target ent_seq, target sense or None, 'xref' or 'ant') tuples
+    def getReferences(self, ent_seq) -> list:
+        if self.graphNodes is None:
+            self.buildGraph()
+        number = self.getGraphNumber(ent_seq)
+        return [self.getEdge(edge) for edge in range(self.graphOffsets[number], self.graphOffsets[number + 1])]
+
+    # References made to the entry by other entries, in the same form as getReferences
+    def getReferrers(self, ent_seq) -> list:
+        if self.graphNodes is None:
+            self.buildGraph()
+        number = self.getGraphNumber(ent_seq)
+        return [self.getEdge(edge) for edge in self.reverseEdges[self.reverseOffsets[number]:self.reverseOffsets[number + 1]]]
+
+    # ent_seqs of the entries reachable from ent_seq by following at most hops references, in either direction
+    def getRelated(self, ent_seq, hops=2) -> list:
+        if self.graphNodes is None:
+            self.buildGraph()
+        start = self.getGraphNumber(ent_seq)
+        seen = {start}
+        frontier = [start]
+        for hop in range(hops):
+            reached = []
+            for number in frontier:
+                neighbours = self.graphTargets[self.graphOffsets[number]:self.graphOffsets[number + 1]].tolist()
+                for edge in self.reverseEdges[self.reverseOffsets[number]:self.reverseOffsets[number + 1]]:
+                    neighbours.append(self.graphSources[edge])
+                for neighbour in neighbours:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        reached.append(neighbour)
+            frontier = reached
+        seen.discard(start)
+        return [self.graphNodes[number] for number in sorted(seen)]
+
+    def getGraphNumber(self, ent_seq) -> int:
+        if ent_seq not in self.graphNumbers:
+            raise Exception(ent_seq)
+        return self.graphNumbers[ent_seq]
+
+    # Writes one line per reference that buildGraph could not resolve: ent_seq, sense number, xref or ant, reference
+    def writeUnresolved(self, out):
+        if self.graphNodes is None:
+            self.buildGraph()
+        for ent_seq, sense, kind, reference in self.unresolvedReferences:
+            out.write('{ent_seq}\t{sense}\t{kind}\t{reference}\n'.format(ent_seq=ent_seq, sense=sense + 1, kind=kind, reference=reference))
+
+    def hashFile(self, filename) -> bytes:
+        digest = hashlib.sha256()
+        with open(filename, "rb") as read_file:
+            block = read_file.read(1 << 20)
+            while block != b'':
+                digest.update(block)
+                block = read_file.read(1 << 20)
+        return digest.digest()
+
+    # The selected fields and languages are part of the header, so that a snapshot is only loaded with the same selection
+    def getSnapshotHeader(self, sourceHash) -> bytes:
+        selection = repr((sorted(self.fields), None if self.languages is None else sorted(self.languages))).encode("utf8")
+        return snapshotMagic + struct.pack('<I', snapshotVersion) + sourceHash + hashlib.sha256(selection).digest()
+
+    # Writes the entries and entity tables, pickled, after a header identifying the format and the source file.
+    #   The file is written under a temporary name first so that an interrupted run never leaves a partial snapshot
+    def saveSnapshot(self, snapshot, sourceHash):
+        temporary = snapshot + '.tmp'
+        with open(temporary, "wb") as write_file:
+            write_file.write(self.getSnapshotHeader(sourceHash))
+            pickle.dump((self.entities.entities, self.entities.codes, self.entries), write_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, snapshot)
+
+    # Returns False, leaving the controller untouched, when the snapshot is missing, unreadable, or was made from a
+    #   different source file or snapshot version
+    def loadSnapshot(self, snapshot, sourceHash) -> bool:
+        header = self.getSnapshotHeader(sourceHash)
+        # The model holds no reference cycles, so the cyclic garbage collector, which would otherwise run over and over
+        #   again on the growing set of objects, is paused while it is rebuilt. Loading is several times faster
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(snapshot, "rb") as read_file:
+                if read_file.read(len(header)) != header:
+                    return False
+                entities, codes, entries = pickle.load(read_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        finally:
+            if gcEnabled:
+                gc.enable()
+        for entityType, values in entities.items():
+            self.entities.addEntityType(entityType, values['__name__'])
+            for entityName, entityValue in values.items():
+                if entityName != '__name__':
+                    self.entities.addEntity(entityType, entityName, entityValue)
+        ids = [self.entities.getId(code) for code in codes]
+        if ids != list(range(len(ids))):
+            self.remapEntities(entries, ids)
+        self.entries = entries
+        return True
+
+    # Replaces the entity ids of entries, loaded from a snapshot, by ids[id] when this process numbered them differently
+    def remapEntities(self, entries, ids):
+        remap = lambda values: tuple([ids[value] for value in values])
+        for entry in entries.values():
+            for k_ele in entry.k_ele:
+                k_ele.ke_inf = remap(k_ele.ke_inf)
+            for r_ele in entry.r_ele:
+                r_ele.re_inf = remap(r_ele.re_inf)
+            for sense in entry.sense:
+                sense.pos = remap(sense.pos)
+                sense.field = remap(sense.field)
+                sense.misc = remap(sense.misc)
+                sense.dial = remap(sense.dial)
+
+    # Writes an index of the byte offset and length of every entry in filename, sorted by ent_seq, for EntryIndex
+    def buildIndex(self, filename, indexFilename):
+        self.checkUncompressed(filename)
+        records = []
+        with open(filename, "rb") as read_file:
+            size = os.fstat(read_file.fileno()).st_size
+            if size > 0:
+                with mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                    for match in entryPattern.finditer(source):
+                        records.append((int(match.group(1)), match.start(), match.end() - match.start()))
+        records.sort()
+        temporary = indexFilename + '.tmp'
+        with open(temporary, "wb") as write_file:
+            write_file.write(indexHeader.pack(indexMagic, indexVersion, size, len(records)))
+            for record in records:
+                write_file.write(indexRecord.pack(*record))
+        os.replace(temporary, indexFilename)
+        self.count = len(records)
+
+    # Hash of the normalized model of an entry, so that changes to the layout of the XML are not seen as edits
+    def hashEntry(self, entry) -> bytes:
+        return hashlib.blake2b(entry.toString().encode("utf8"), digest_size=16).digest()
+
+    # Returns the hashes of a manifest written by saveChanges, keyed by ent_seq, or an empty dict if there is no manifest
+    def loadManifest(self, manifest) -> dict:
+        if not os.path.exists(manifest):
+            return {}
+        with open(manifest, "rb") as read_file:
+            data = read_file.read()
+        magic, version, count = manifestHeader.unpack_from(data, 0)
+        if magic != manifestMagic or version != manifestVersion:
+            raise Exception(manifest)
+        return dict(manifestRecord.iter_unpack(data[manifestHeader.size:manifestHeader.size + count * manifestRecord.size]))
+
+    def saveManifest(self, manifest, hashes):
+        temporary = manifest + '.tmp'
+        with open(temporary, "wb") as write_file:
+            write_file.write(manifestHeader.pack(manifestMagic, manifestVersion, len(hashes)))
+            for ent_seq in sorted(hashes):
+                write_file.write(manifestRecord.pack(ent_seq, hashes[ent_seq]))
+        os.replace(temporary, manifest)
+
+    # Compares the entries of filename with the hashes in manifest, left by the previous run, and writes only the
+    #   differences as JSON Lines: {"added": entry}, {"changed": entry} or {"removed": ent_seq}. Entries are streamed as in
+    #   saveInPlace. The manifest is then replaced by the hashes of filename, or written to newManifest if given.
+    #   Without a manifest every entry is added. Entities are hashed and written as codes, whatever the entity output of
+    #   the controller. Returns the number of added, changed and removed entries
+    def saveChanges(self, filename, manifest, output=None, compression=None, newManifest=None) -> tuple:
+        previous = self.loadManifest(manifest)
+        self.instrumentation.start(self.getInputSize(filename))
+        hashes = {}
+        added = 0
+        changed = 0
+        with self.openOutput(output, 'jsonl', compression, 'changes') as write_file:
+            for entry in self.trackEntries(self.iterEntries(filename)):
+                ent_seq = int(entry.ent_seq)
+                digest = self.hashEntry(entry)
+                hashes[ent_seq] = digest
+                old = previous.pop(ent_seq, None)
+                if old == digest:
+                    continue
+                if old is None:
+                    write_file.write('{"added":')
+                    added += 1
+                else:
+                    write_file.write('{"changed":')
+                    changed += 1
+                entry.write(write_file, 0, 0, '')
+                write_file.write('}\n')
+            for ent_seq in sorted(previous):
+                write_file.write('{{"removed":"{ent_seq}"}}\n'.format(ent_seq=ent_seq))
+        self.saveManifest(manifest if newManifest is None else newManifest, hashes)
+        return added, changed, len(previous)
+
+    # Writes entries as they are parsed from filename, so that they are never all kept in memory. With a checkpoint path,
+    #   the output is flushed to disk every checkpointInterval entries and checkpoint records how far the input and
+    #   output got, so that with resume a run that died partway continues from the last checkpoint instead of starting
+    #   over. The checkpoint is removed once the output is complete. Checkpoints need the path of the file and an
+    #   uncompressed output
+    def saveInPlace(self, filename, indent=0, initialIndent=0, output=None, format='json', compression=None, checkpoint=None,
+            resume=False):
+        self.instrumentation.start(self.getInputSize(filename))
+        if checkpoint is None:
+            if resume:
+                raise Exception('Resuming needs a checkpoint')
+            with self.openOutput(output, format, compression) as write_file:
+                self.writeEntries(write_file, self.trackEntries(self.iterEntries(filename)), indent, initialIndent, format)
+                epoch = time.perf_counter()
+            self.timePhase('write', epoch)
+            return
+        if compression is not None:
+            raise Exception('Checkpoints are not used with compressed output')
+        if not isinstance(filename, (str, os.PathLike)):
+            raise Exception('Checkpoints need the path of the JMdict file')
+        if format not in outputFormats:
+            raise Exception(format)
+        if output is None:
+            output = 'output' + outputFormats[format]
+        # A checkpoint is only used by the same conversion of the same file
+        settings = {'input': os.path.abspath(filename), 'size': os.path.getsize(filename), 'output': os.path.abspath(output),
+            'format': format, 'indent': indent, 'initialIndent': initialIndent, 'parser': self.parser,
+            'fields': sorted(self.fields), 'languages': None if self.languages is None else sorted(self.languages),
+            'entities': self.entityOutput}
+        state = self.loadCheckpoint(checkpoint) if resume else None
+        offset = None
+        count = 0
+        if state is not None:
+            if state['settings'] != settings:
+                raise Exception('{checkpoint} was left by another conversion'.format(checkpoint=checkpoint))
+            offset = state['offset']
+            count = state['entries']
+            self.processHeader(filename)
+            os.truncate(output, state['length'])
+        with open(output, "w" if state is None else "a", encoding="utf8") as write_file:
+            entries = self.trackEntries(self.iterEntries(filename, offset), count)
+            entries = self.checkpointEntries(entries, write_file, checkpoint, settings, count)
+            self.writeEntries(write_file, entries, indent, initialIndent, format, count > 0)
+            epoch = time.perf_counter()
+        self.timePhase('write', epoch)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    # Passes entries through, saving a checkpoint every checkpointInterval entries. When an entry is asked for, the one
+    #   before it was written to write_file, and the parser stopped right after it in the input
+    def checkpointEntries(self, entries, write_file, checkpoint, settings, count=0):
+        for entry in entries:
+            yield entry
+            count += 1
+            if count % checkpointInterval == 0:
+                write_file.flush()
+                os.fsync(write_file.fileno())
+                self.saveCheckpoint(checkpoint, {'settings': settings, 'offset': self.getEntryEnd(), 'entries': count,
+                    'length': write_file.tell()})
+
+    # Returns the state saved by saveCheckpoint, or None if there is no checkpoint
+    def loadCheckpoint(self, checkpoint):
+        if not os.path.exists(checkpoint):
+            return None
+        with open(checkpoint, "r", encoding="utf8") as read_file:
+            return json.load(read_file)
+
+    # The checkpoint is replaced only once the new one is on disk, so that there is always a whole one
+    def saveCheckpoint(self, checkpoint, state):
+        temporary = checkpoint + '.tmp'
+        with open(temporary, "w", encoding="utf8") as write_file:
+            json.dump(state, write_file)
+            write_file.flush()
+            os.fsync(write_file.fileno())
+        os.replace(temporary, checkpoint)
+
+    # Opens the output file for writing, compressing it on the fly if compression is given. Without a path, the output
+    #   goes to name followed by the extension of the format and of the compression, output.json by default
+    def openOutput(self, output=None, format='json', compression=None, name='output'):
+        if format not in outputFormats:
+            raise Exception(format)
+        if compression is not None and compression not in outputCompressions:
+            raise Exception(compression)
+        if output is None:
+            output = name + outputFormats[format] + outputCompressions.get(compression, '')
+        if compression == 'gzip':
+            return gzip.open(output, "wt", compresslevel=6, encoding="utf8")
+        elif compression == 'bz2':
+            return bz2.open(output, "wt", encoding="utf8")
+        elif compression == 'xz':
+            return lzma.open(output, "wt", encoding="utf8")
+        return open(output, "w", encoding="utf8")
+
+    # Passes entries through, keeping self.count and the instrumentation up to date. When the instrumentation is timed,
+    #   the time spent getting each entry counts as parsing, and the time until the next one is asked for as serializing
+    def trackEntries(self, entries, count=0):
+        self.count = count
+        instrumentation = self.instrumentation
+        timed = instrumentation.timed
+        epoch = time.perf_counter()
+        for entry in entries:
+            if timed:
+                epoch = self.timePhase('parse', epoch)
+            yield entry
+            if timed:
+                epoch = self.timePhase('serialize', epoch)
+            self.count += 1
+            if self.count % 1000 == 0:
+                instrumentation.progress(self.count, self.getPosition())
+        instrumentation.progress(self.count, instrumentation.size)
+
+    # Writes entries as a JSON array. Separating commas are written before every entry but the first, so no trailing
+    #   comma has to be removed afterwards. In the jsonl format, entries are written one per line and indent is ignored.
+    #   With started, out already holds the start of the array and some entries, and the rest of them are added
+    def writeEntries(self, out, entries, indent=0, initialIndent=0, format='json', started=False):
+        if format == 'jsonl':
+            for entry in entries:
+                entry.write(out, 0, 0, '', self.entityOutput)
+                out.write('\n')
+            return
         newline = self.getNewline(indent)
         whitespace2 = self.getWhitespace(indent, initialIndent-indent)
-        msg = self.toStringInPlace(filename, write_file, indent, initialIndent)
-        msg = msg[0:-1] # Remove trailing comma
-        msg += "{newline}{whitespace2}]".format(newline=newline, whitespace2=whitespace2)
-        self.appendToFile(msg)
-
-    def appendToFile(self, msg):
-        write_file = open('output.json', "a", encoding="utf8")
-        write_file.write(msg)
+        comma = ','
+        if not started:
+            comma = ''
+            out.write("[")
+        for entry in entries:
+            out.write(comma)
+            entry.write(out, indent, initialIndent+indent, '', self.entityOutput)
+            comma = ','
+        out.write("{newline}{whitespace2}]".format(newline=newline, whitespace2=whitespace2))
 
-    def toStringInPlace(self, filename, write_file, indent=0, initialIndent=0):
-        msg = "["
-        self.count = 0
-        self.read_file = open(filename, "r", encoding="utf8")
-##          DON'T USE READLINES - No need to load into memory
+    # Reads the DTD header up to the first entry, filling self.entities
+    def processHeader(self, filename):
+        self.read_file = self.openInput(filename)
         line = self.read_file.readline()
-        while (line != ''):
+        while (line != '' and '<entry>' not in line):
+            if line.startswith('<!-- <'):
+                line = self.processEntities(line)
+                continue
             if ('<!-- ' in line):
-                if ('-->' in line):
-                    self.processEntities(line)
                 while ('-->' not in line):
                     line = self.read_file.readline()
-            elif '<entry>' in line:
-                msg += self.processEntry(lowMemory=True).toString(indent, initialIndent+indent, ',')
-                self.count += 1
-                if self.count % 1000 == 0:
-                    self.printStatus()
-                if self.count % 10000 == 0:
-                    self.appendToFile(msg)
-                    msg = ""
-            try:
-                line = self.read_file.readline()
-            except Exception:
-                line = None
+            line = self.read_file.readline()
+        self.closeInput(filename, self.read_file)
+
+    # Splits the file into at most `chunks` byte ranges of roughly equal size, each starting on an <entry> line, which
+    #   may be indented. Raises if the file has entries but none of them starts a line
+    def findChunkOffsets(self, filename, chunks) -> list:
+        size = os.path.getsize(filename)
+        offsets = []
+        with open(filename, "rb") as read_file:
+            for i in range(chunks):
+                read_file.seek(size * i // chunks)
+                # Offset of the first byte of buffer, which starts with a newline standing for the line break before the
+                #   position sought
+                start = read_file.tell() - 1
+                buffer = b'\n'
+                while True:
+                    block = read_file.read(1 << 16)
+                    buffer += block
+                    match = entryLinePattern.search(buffer)
+                    if match is not None or block == b'':
+                        break
+                    # Only the last line is kept, as its indentation may be followed by <entry> in the next block
+                    last = buffer.rfind(b'\n')
+                    kept = buffer[last:] if last != -1 else b''
+                    start += len(buffer) - len(kept)
+                    buffer = kept
+                if match is None:
+                    break
+                offset = start + match.end() - len(b'<entry>')
+                if len(offsets) == 0 or offset > offsets[-1]:
+                    offsets.append(offset)
+            if len(offsets) == 0 and size > 0:
+                with mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                    if source.find(b'<entry>') != -1:
+                        raise Exception('No <entry> of {filename} starts a line, so it cannot be split'.format(filename=filename))
+        offsets.append(size)
+        return offsets
+
+    # Serializes every entry found in text, a slice of the JMdict file made of whole entries. Returns one string per entry
+    def toStringChunk(self, text, indent=0, initialIndent=0) -> list:
+        msg = []
+        self.count = 0
+        for entry in self.iterEntries(io.StringIO(text)):
+            msg.append(entry.toString(indent, initialIndent+indent, '', self.entityOutput))
         return msg
 
-    def toString(self, indent=0, initialIndent=0):
+    # Same output as saveInPlace, with the entries parsed and serialized by a pool of worker processes.
+    # The file is split into several chunks per worker so that the pool stays busy until the end
+    def saveParallel(self, filename, workers, indent=0, initialIndent=0, output=None, format='json', compression=None):
+        # Entities missing from the DTD would be numbered separately by each worker
+        if self.entityOutput == 'ids':
+            raise Exception('Entity ids are not used with workers')
+        self.checkUncompressed(filename)
+        self.processHeader(filename)
+        offsets = self.findChunkOffsets(filename, workers * 4)
+        if format == 'jsonl':
+            indent = 0
+            initialIndent = 0
+        tasks = [(filename, offsets[i], offsets[i + 1], indent, initialIndent, format) for i in range(len(offsets) - 1)]
         newline = self.getNewline(indent)
         whitespace2 = self.getWhitespace(indent, initialIndent-indent)
-        msg = "["
-        comma=','
-        for entry in self.entries.values():
-            msg += entry.toString(indent, initialIndent+indent, comma)
-        msg = msg[0:-1]
-        msg += "{newline}{whitespace2}]".format(newline=newline, whitespace2=whitespace2)
-        return msg
+        self.count = 0
+        instrumentation = self.instrumentation
+        instrumentation.start(os.path.getsize(filename))
+        epoch = time.perf_counter()
+        with self.openOutput(output, format, compression) as write_file:
+            comma = ''
+            if format == 'json':
+                write_file.write("[")
+            with multiprocessing.Pool(workers, initWorker, (self.parser, self.entities, self.fields, self.languages,
+                    self.entityOutput)) as pool:
+                for i, (count, chunk) in enumerate(pool.imap(convertChunk, tasks)):
+                    self.count += count
+                    instrumentation.progress(self.count, tasks[i][2])
+                    if count == 0:
+                        continue
+                    if format == 'json':
+                        write_file.write(comma)
+                        comma = ','
+                    write_file.write(chunk)
+            if format == 'json':
+                write_file.write("{newline}{whitespace2}]".format(newline=newline, whitespace2=whitespace2))
+            epoch = self.timePhase('convert', epoch)
+        self.timePhase('write', epoch)
+
+    def write(self, out, indent=0, initialIndent=0, format='json'):
+        self.writeEntries(out, self.entries.values(), indent, initialIndent, format)
+
+    def saveData(self, indent=0, output=None, format='json', compression=None):
+        with self.openOutput(output, format, compression) as write_file:
+            epoch = time.perf_counter()
+            self.write(write_file, indent, 0, format)
+            epoch = self.timePhase('serialize', epoch)
+        self.timePhase('write', epoch)
+
+# Random access to the entries of a JMdict file through an index written by Controller.buildIndex. Both files are
+#   memory-mapped: lookups binary search the fixed-width records and only parse the requested entries
+class EntryIndex:
+    def __init__(self, filename, indexFilename, parser='regex'):
+        self.controller = Controller(parser)
+        self.index_file = open(indexFilename, "rb")
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, self.count = indexHeader.unpack_from(self.index, 0)
+        if magic != indexMagic or version != indexVersion:
+            raise Exception('{indexFilename} is not a version {version} index'.format(indexFilename=indexFilename, version=indexVersion))
+        self.read_file = open(filename, "rb")
+        if os.fstat(self.read_file.fileno()).st_size != size:
+            raise Exception('{indexFilename} was built for another version of {filename}'.format(indexFilename=indexFilename, filename=filename))
+        self.source = mmap.mmap(self.read_file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return indexRecord.unpack_from(self.index, indexHeader.size + i * indexRecord.size)[0]
+
+    def getRecord(self, ent_seq):
+        i = bisect.bisect_left(self, int(ent_seq))
+        if i == self.count:
+            return None
+        record = indexRecord.unpack_from(self.index, indexHeader.size + i * indexRecord.size)
+        return record if record[0] == int(ent_seq) else None
+
+    # Returns the raw XML of the entry, or None if there is no entry with that ent_seq
+    def getText(self, ent_seq):
+        record = self.getRecord(ent_seq)
+        if record is None:
+            return None
+        ent_seq, offset, length = record
+        return self.source[offset:offset + length].decode("utf8")
+
+    def lookup(self, ent_seq):
+        text = self.getText(ent_seq)
+        if text is None:
+            return None
+        return next(self.controller.iterEntries(io.StringIO(text)))
+
+    # Looks up several entries at once, reading them in file order. Missing entries are left out
+    def lookupMany(self, ent_seqs) -> list:
+        records = [record for record in map(self.getRecord, ent_seqs) if record is not None]
+        records.sort(key=lambda record: record[1])
+        text = ''.join([self.source[offset:offset + length].decode("utf8") for ent_seq, offset, length in records])
+        return list(self.controller.iterEntries(io.StringIO(text)))
 
-    def saveData(self, indent=0):
-        with open('output.json', "w", encoding="utf8") as write_file:
-            write_file.write(self.toString(indent,0))
+    def close(self):
+        self.index.close()
+        self.index_file.close()
+        if len(self.source) > 0:
+            self.source.close()
+        self.read_file.close()
+
+# Mapped JMdict file of a lazily loaded dictionary. Entries are parsed by a controller of their own, so that decoding
+#   never disturbs a file being read by the controller holding them. Decoded entries are kept on their LazyEntry when
+#   cache is set, and parsed again on every access otherwise, which keeps memory flat when every entry is read once
+class LazySource:
+    def __init__(self, filename, parser='regex', fields=None, languages=None, cache=True):
+        self.controller = Controller(parser, None, fields, languages)
+        self.cache = cache
+        self.decoded = 0
+        self.read_file = open(filename, "rb")
+        size = os.fstat(self.read_file.fileno()).st_size
+        self.source = mmap.mmap(self.read_file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+    def decode(self, offset, length) -> Entry:
+        self.decoded += 1
+        text = self.source[offset:offset + length].decode("utf8")
+        return next(self.controller.iterEntries(io.StringIO(text)))
+
+    def close(self):
+        if len(self.source) > 0:
+            self.source.close()
+        self.read_file.close()
+
+# Controller of a worker process started by Controller.saveParallel
+workerController = None
+
+# The worker uses the entity table and entity output of the main process, so that entities get the same ids and labels
+def initWorker(parser, entities, fields, languages, entityOutput):
+    global workerController, entityTable
+    entityTable = entities
+    workerController = Controller(parser, None, fields, languages)
+    workerController.setEntityOutput(entityOutput)
+
+def convertChunk(task):
+    filename, start, end, indent, initialIndent, format = task
+    with open(filename, "rb") as read_file:
+        read_file.seek(start)
+        text = read_file.read(end - start).decode("utf8")
+    msg = workerController.toStringChunk(text, indent, initialIndent)
+    if format == 'jsonl':
+        return len(msg), ''.join([line + '\n' for line in msg])
+    return len(msg), ','.join(msg)
 
 if __name__ == '__main__':
     try:
         indent = 0
         lowMemory = False
+        resume = False
+        parser = 'regex'
+        workers = 1
+        snapshot = None
+        index = None
+        output = None
+        format = 'json'
+        compression = None
+        manifest = None
+        unresolved = None
+        entityOutput = 'codes'
+        legend = 'legend.json'
+        metrics = None
+        fields = None
+        languages = None
         if len(sys.argv) > 0:
             for i in range(1, len(sys.argv)):
-                option = re.search(r'--([a-z-]*)(=([a-z0-9]*))*', sys.argv[i])
+                option = re.search(r'--([a-z-]*)(=(.*))*', sys.argv[i])
                 if option == None:
                     raise Exception(sys.argv[i])
                 name = option.group(1)
                 if name == 'low-memory':
                     lowMemory = True
                     continue
+                if name == 'resume':
+                    resume = True
+                    continue
                 value = option.group(3)
                 if name == 'indent':
                     indent = int(value)
+                elif name == 'parser':
+                    parser = value
+                elif name == 'workers':
+                    workers = int(value)
+                elif name == 'snapshot':
+                    snapshot = value
+                elif name == 'build-index':
+                    index = value
+                elif name == 'entities':
+                    if value not in entityOutputs:
+                        raise Exception(sys.argv[i])
+                    entityOutput = value
+                elif name == 'fields':
+                    fields = value.split(',')
+                elif name == 'languages':
+                    languages = value.split(',')
+                elif name == 'metrics':
+                    metrics = value
+                elif name == 'legend':
+                    legend = value
+                elif name == 'unresolved':
+                    unresolved = value
+                elif name == 'diff':
+                    manifest = value
+                elif name == 'input':
+                    filename = sys.stdin.buffer if value == '-' else value
+                elif name == 'output':
+                    output = value
+                elif name == 'format':
+                    if value not in outputFormats:
+                        raise Exception(sys.argv[i])
+                    format = value
+                elif name == 'compress':
+                    if value not in outputCompressions:
+                        raise Exception(sys.argv[i])
+                    compression = value
                 else:
                     raise Exception(sys.argv[i])
-        controller = Controller()
-        print('loading dict')
-        epoch = time.time()
-
-        if (lowMemory):
-            controller.saveInPlace(filename, indent)
+        if (entityOutput == 'ids' and workers > 1):
+            raise Exception('--entities=ids cannot be used with --workers')
+        # Checkpoints are only kept by low-memory runs, of a file given by path to an uncompressed output
+        if (resume and (not lowMemory or workers > 1 or index is not None or manifest is not None)):
+            raise Exception('--resume is only used with --low-memory, without --workers, --build-index or --diff')
+        if (resume and (compression is not None or not isinstance(filename, str))):
+            raise Exception('--resume needs an uncompressed output and an input read from a file')
+        if (metrics is not None):
+            instrumentation = MetricsFile(metrics)
+        elif sys.stderr.isatty():
+            instrumentation = StatusLine()
         else:
-            controller.loadDict(filename)
-            controller.saveData(indent)
-        print('Time elapsed: ' + str(time.time() - epoch))
-
+            instrumentation = Instrumentation()
+        # Controller raises on an unknown parser or field
+        controller = Controller(parser, instrumentation, fields, languages)
+        controller.setEntityOutput(entityOutput)
     except Exception as e:
         print("Invalid argument '{invalidArg}'".format(invalidArg=e.args[0]))
+        sys.exit(2)
+
+    print('loading dict')
+    epoch = time.time()
+
+    if (index is not None):
+        controller.buildIndex(filename, index)
+    elif (manifest is not None):
+        added, changed, removed = controller.saveChanges(filename, manifest, output, compression)
+        print('{added} added, {changed} changed, {removed} removed'.format(added=added, changed=changed, removed=removed))
+    elif (workers > 1):
+        controller.saveParallel(filename, workers, indent, 0, output, format, compression)
+    elif (lowMemory):
+        checkpoint = None
+        if compression is None and isinstance(filename, str):
+            checkpoint = (output if output is not None else 'output' + outputFormats[format]) + '.checkpoint'
+        controller.saveInPlace(filename, indent, 0, output, format, compression, checkpoint, resume)
+    else:
+        controller.loadDict(filename, snapshot)
+        controller.saveData(indent, output, format, compression)
+        if (unresolved is not None):
+            with open(unresolved, "w", encoding="utf8") as write_file:
+                controller.writeUnresolved(write_file)
+    if (entityOutput == 'ids' and index is None and manifest is None):
+        with open(legend, "w", encoding="utf8") as write_file:
+            controller.entities.writeLegend(write_file)
+    instrumentation.finish()
+    print('Time elapsed: ' + str(time.time() - epoch))
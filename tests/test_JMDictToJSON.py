@@ -0,0 +1,222 @@
+import os
+import sys
+import io
+import json
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import JMDictToJSON
+import JMDictGenerator
+
+parsers = ('regex', 'lexer', 'expat')
+
+# Two entries using every field of the model, including an lsource without xml:lang that expat must not fill in with the
+#   default of the DTD
+sampleEntries = '''<entry>
+<ent_seq>1000010</ent_seq>
+<k_ele>
+<keb>学校</keb>
+<ke_pri>news1</ke_pri>
+<ke_pri>nf01</ke_pri>
+</k_ele>
+<k_ele>
+<keb>學校</keb>
+<ke_inf>&oK;</ke_inf>
+</k_ele>
+<r_ele>
+<reb>がっこう</reb>
+<re_pri>news1</re_pri>
+</r_ele>
+<r_ele>
+<reb>ガッコー</reb>
+<re_nokanji/>
+<re_inf>&ik;</re_inf>
+</r_ele>
+<r_ele>
+<reb>まなびや</reb>
+<re_restr>學校</re_restr>
+</r_ele>
+<sense>
+<stagk>学校</stagk>
+<pos>&n;</pos>
+<pos>&adj-na;</pos>
+<xref>教室・1</xref>
+<field>&comp;</field>
+<misc>&uk;</misc>
+<s_inf>often in compounds</s_inf>
+<lsource xml:lang="ger">Schule</lsource>
+<dial>&ksb;</dial>
+<gloss>school</gloss>
+<gloss g_type="expl">place of learning</gloss>
+</sense>
+<sense>
+<stagr>まなびや</stagr>
+<ant>家</ant>
+<lsource ls_wasei="y"/>
+<lsource ls_type="part">class</lsource>
+<gloss xml:lang="ger">Schule</gloss>
+<gloss xml:lang="fre">école</gloss>
+</sense>
+</entry>
+<entry>
+<ent_seq>1000020</ent_seq>
+<r_ele>
+<reb>ああ</reb>
+</r_ele>
+<sense>
+<pos>&int;</pos>
+<gloss>ah!</gloss>
+</sense>
+</entry>
+'''
+
+# Output of the baseline regex parser for sampleEntries, with an indent of 0
+sampleOutput = ('[{"ent_seq":"1000010","k_ele":[{"keb":"学校","ke_pri":["news1","nf01"]},{"keb":"學校","ke_inf":["oK"]}],'
+    '"r_ele":[{"reb":"がっこう","re_nokanji":"false","re_pri":["news1"]},{"reb":"ガッコー","re_nokanji":"true","re_inf":["ik"]},'
+    '{"reb":"まなびや","re_nokanji":"false","re_restr":["學校"]}],"sense":[{"stagk":["学校"],"pos":["n","adj-na"],'
+    '"xref":["教室・1"],"field":["comp"],"misc":["uk"],"s_inf":["often in compounds"],"lsource":["ger"],"dial":["ksb"],'
+    '"gloss":["school","place of learning"]},{"stagr":["まなびや"],"ant":["家"],"gloss":["Schule","école"]}]},'
+    '{"ent_seq":"1000020","r_ele":[{"reb":"ああ","re_nokanji":"false"}],"sense":[{"pos":["int"],"gloss":["ah!"]}]}]')
+
+# Writes entries after the DTD header of the generator, with each element line prefixed by indentation
+def writeDictionary(filename, entries, indentation=''):
+    header = io.StringIO()
+    JMDictGenerator.Generator().writeHeader(header)
+    lines = [indentation + line for line in entries.splitlines(True)]
+    with open(filename, "w", encoding="utf8", newline='\n') as write_file:
+        write_file.write(header.getvalue() + ''.join(lines) + '</JMdict>\n')
+
+# Ways of converting a file: loading every entry first, streaming them, or splitting the file between two workers
+modes = ('saveData', 'saveInPlace', 'saveParallel')
+
+# Converts filename with parser in one of modes, and returns the output
+def convert(directory, filename, parser, indent=0, mode='saveData') -> str:
+    output = os.path.join(directory, 'output.json')
+    controller = JMDictToJSON.Controller(parser)
+    if mode == 'saveInPlace':
+        controller.saveInPlace(filename, indent, 0, output)
+    elif mode == 'saveParallel':
+        controller.saveParallel(filename, 2, indent, 0, output)
+    else:
+        controller.loadDict(filename)
+        controller.saveData(indent, output)
+    with open(output, "r", encoding="utf8") as read_file:
+        return read_file.read()
+
+# Stops a conversion with KeyboardInterrupt once it reaches stopAt entries, as if the process had been killed
+class Interruption(JMDictToJSON.Instrumentation):
+    def __init__(self, stopAt):
+        self.stopAt = stopAt
+        super().__init__()
+
+    def progress(self, entries, position=None):
+        super().progress(entries, position)
+        if entries >= self.stopAt:
+            raise KeyboardInterrupt()
+
+@pytest.fixture
+def sample(tmp_path):
+    filename = str(tmp_path / 'JMdict_sample')
+    writeDictionary(filename, sampleEntries)
+    return filename
+
+@pytest.fixture(scope='module')
+def generated(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('generated') / 'JMdict_generated')
+    JMDictGenerator.generate(filename, 2000, 3)
+    return filename
+
+@pytest.mark.parametrize('mode', modes)
+@pytest.mark.parametrize('parser', parsers)
+def test_sampleMatchesBaseline(tmp_path, sample, parser, mode):
+    assert convert(str(tmp_path), sample, parser, 0, mode) == sampleOutput
+    assert json.loads(convert(str(tmp_path), sample, parser, 2, mode)) == json.loads(sampleOutput)
+
+@pytest.mark.parametrize('mode', modes)
+@pytest.mark.parametrize('indent', (0, 2))
+@pytest.mark.parametrize('parser', parsers)
+def test_parsersMatchRegex(tmp_path, generated, parser, indent, mode):
+    expected = convert(str(tmp_path), generated, 'regex', indent)
+    assert convert(str(tmp_path), generated, parser, indent, mode) == expected
+
+@pytest.mark.parametrize('mode', modes)
+@pytest.mark.parametrize('parser', ('lexer', 'expat'))
+def test_indentedLines(tmp_path, parser, mode):
+    filename = str(tmp_path / 'JMdict_indented')
+    writeDictionary(filename, sampleEntries, '  ')
+    assert convert(str(tmp_path), filename, parser, 0, mode) == sampleOutput
+
+@pytest.mark.parametrize('parser', parsers)
+def test_interleavedIterations(tmp_path, sample, generated, parser):
+    expected = [[entry.toString() for entry in JMDictToJSON.Controller(parser).iterEntries(filename)] for filename in (generated, sample)]
+    controller = JMDictToJSON.Controller(parser)
+    first = controller.iterEntries(generated)
+    second = controller.iterEntries(sample)
+    # Each iteration is advanced in turn, and the first one keeps going after the second is done
+    entries = [[], []]
+    for entry in second:
+        entries[0].append(next(first).toString())
+        entries[1].append(entry.toString())
+    entries[0].extend([entry.toString() for entry in first])
+    assert entries == expected
+
+def test_entityOutputPerController(tmp_path, sample):
+    described = JMDictToJSON.Controller('regex')
+    described.setEntityOutput('descriptions')
+    described.loadDict(sample)
+    output = str(tmp_path / 'described.json')
+    described.saveData(0, output)
+    with open(output, "r", encoding="utf8") as read_file:
+        entries = json.loads(read_file.read())
+    descriptions = described.entities.descriptions
+    assert entries[0]['sense'][0]['pos'] == [descriptions['n'], descriptions['adj-na']]
+    # Controllers share the entity table, but not how it is written
+    assert convert(str(tmp_path), sample, 'regex') == sampleOutput
+
+@pytest.mark.parametrize('cache', (True, False))
+@pytest.mark.parametrize('parser', parsers)
+def test_lazyMatchesFullLoad(tmp_path, generated, parser, cache):
+    full = JMDictToJSON.Controller(parser)
+    full.loadDict(generated)
+    lazy = JMDictToJSON.Controller(parser)
+    lazy.loadDict(generated, lazy=True, cache=cache)
+    assert list(lazy.entries) == list(full.entries)
+    assert lazy.lazySource.decoded == 0
+    for headword in sorted(full.headwords)[::40]:
+        expected = [entry.toString() for entry in full.lookupHeadword(headword)]
+        assert [entry.toString() for entry in lazy.lookupHeadword(headword)] == expected
+    output = str(tmp_path / 'lazy.json')
+    lazy.saveData(2, output)
+    lazy.lazySource.close()
+    with open(output, "r", encoding="utf8") as read_file:
+        assert read_file.read() == convert(str(tmp_path), generated, parser, 2)
+
+@pytest.mark.parametrize('format, indent', (('json', 0), ('json', 2), ('jsonl', 0)))
+@pytest.mark.parametrize('parser', parsers)
+def test_resumeMatchesFullConversion(tmp_path, generated, monkeypatch, parser, format, indent):
+    expected = str(tmp_path / 'expected')
+    JMDictToJSON.Controller(parser).saveInPlace(generated, indent, 0, expected, format)
+    monkeypatch.setattr(JMDictToJSON, 'checkpointInterval', 300)
+    output = str(tmp_path / 'output')
+    checkpoint = output + '.checkpoint'
+    # The run is stopped after 1000 entries, past the last checkpoint at 900, so that the output holds entries that are
+    #   written again on resuming
+    with pytest.raises(KeyboardInterrupt):
+        JMDictToJSON.Controller(parser, Interruption(1000)).saveInPlace(generated, indent, 0, output, format, None, checkpoint)
+    with open(checkpoint, "r", encoding="utf8") as read_file:
+        state = json.load(read_file)
+    assert state['entries'] == 900
+    assert os.path.getsize(output) > state['length']
+    JMDictToJSON.Controller(parser).saveInPlace(generated, indent, 0, output, format, None, checkpoint, True)
+    assert not os.path.exists(checkpoint)
+    with open(output, "rb") as read_file, open(expected, "rb") as expected_file:
+        assert read_file.read() == expected_file.read()
+
+def test_resumeRejectsOtherConversion(tmp_path, generated, monkeypatch):
+    monkeypatch.setattr(JMDictToJSON, 'checkpointInterval', 300)
+    output = str(tmp_path / 'output.json')
+    checkpoint = output + '.checkpoint'
+    with pytest.raises(KeyboardInterrupt):
+        JMDictToJSON.Controller('regex', Interruption(1000)).saveInPlace(generated, 0, 0, output, 'json', None, checkpoint)
+    with pytest.raises(Exception, match='another conversion'):
+        JMDictToJSON.Controller('regex').saveInPlace(generated, 2, 0, output, 'json', None, checkpoint, True)